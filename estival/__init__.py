@@ -1,2 +1,2 @@
-from . import model, priors, targets
+from . import model, priors, targets, transforms
 from . import sampling, wrappers, utils
@@ -1,14 +1,18 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
+from time import perf_counter
+from threading import RLock
 
 from summer2 import CompartmentalModel
 
-from jax import jit
+import jax
+from jax import jit, vmap, value_and_grad
 import numpy as np
+from jax import numpy as jnp
 
 import pandas as pd
 
-from .targets import BaseTarget
+from .targets import BaseTarget, group_evaluators
 from .priors import BasePrior
 
 
@@ -18,6 +22,20 @@ class ResultsData:
     extras: dict
 
 
+@dataclass
+class BatchResultsData:
+    """Results of BayesianCompartmentalModel.run_batch
+    derived_outputs is a dense array with axes (sample, time, output), labelled by
+    index, times and outputs respectively; extras are arrays with a leading sample axis
+    """
+
+    derived_outputs: np.ndarray
+    index: pd.Index
+    times: pd.Index
+    outputs: List[str]
+    extras: dict
+
+
 class BayesianCompartmentalModel:
     def __init__(
         self,
@@ -30,6 +48,7 @@ class BayesianCompartmentalModel:
         whitelist: Optional[list] = None,
     ):
         self.model = model
+        self._cache = None
 
         self._model_parameters = model.get_input_parameters()
 
@@ -77,69 +96,346 @@ class BayesianCompartmentalModel:
         if whitelist is None:
             whitelist = []
 
+        # Construction time (in seconds) of each component, keyed by component name
+        # Components used only by run/run_jax are built lazily, and appear once used
+        self.build_times = {}
+
+        start = perf_counter()
         self._ll_runner = self.model.get_runner(
             self.parameters, dyn_params, include_full_outputs=False, **backend_args
         )
+        self.build_times["ll_runner"] = perf_counter() - start
 
         self.model.set_derived_outputs_whitelist(whitelist)
-        self._full_runner = self.model.get_runner(
-            self.parameters, dyn_params, include_full_outputs=False, **backend_args
-        )
 
+        # Arguments for the full runner, which is built on first use
+        self._full_runner_args = (dyn_params, backend_args, whitelist)
+        self._full_runner_obj = None
+        self._build_lock = RLock()
+        self._logll_multi_func = None
+        self._run_batch_funcs = {}
+
+        start = perf_counter()
         self._evaluators = {}
+        target_evaluators = {}
         for k, t in self.targets.items():
             tev = t.get_evaluator(self._ref_idx, self.epoch)
             self._evaluators[k] = tev.evaluate
+            target_evaluators[k] = tev
+
+        # Targets of the same distribution family are evaluated together as a single
+        # vectorized operation; only custom evaluators are called individually
+        self._stacked_evaluators, self._unstacked_evaluators = group_evaluators(target_evaluators)
+        self.build_times["evaluators"] = perf_counter() - start
 
         extra_ll = self._extra_ll
 
-        @jit
         def logll(**kwargs):
             dict_args = capture_model_kwargs(self.model, **kwargs)
             res = self._ll_runner._run_func(dict_args)["derived_outputs"]
 
             logdens = 0.0
-            for tname, target in self.targets.items():
-                model_key = target.model_key
-                evaluator = self._evaluators[tname]
-                modelled = res[model_key]
-                logdens += evaluator(modelled, kwargs)
+            for stacked in self._stacked_evaluators:
+                logdens += jnp.sum(stacked.evaluate_components(res, kwargs))
+
+            for tname, evaluator in self._unstacked_evaluators.items():
+                modelled = res[evaluator.target.model_key]
+                logdens += evaluator.evaluate(modelled, kwargs)
 
             if extra_ll:
                 logdens += extra_ll(kwargs)
 
             return logdens
 
-        logll.__doc__ = f"""logll({', '.join([k for k in self.priors])})\n
+        def logprior(**kwargs):
+            lp = 0.0
+            for k, p in self.priors.items():
+                lp += jnp.sum(p.logpdf_jax(kwargs[k]))
+            return lp
+
+        def logposterior(**kwargs):
+            return logll(**kwargs) + logprior(**kwargs)
+
+        param_sig = ", ".join([k for k in self.priors])
+
+        logll.__doc__ = f"""logll({param_sig})\n
         Run the model for a given set of parameters, and 
         return the loglikelihood of its outputs, including any values from extrall"""
 
+        logprior.__doc__ = f"""logprior({param_sig})\n
+        Return the summed log density of all priors for a given set of parameters"""
+
+        logposterior.__doc__ = f"""logposterior({param_sig})\n
+        Run the model for a given set of parameters, and return the sum of its
+        loglikelihood and logprior, compiled as a single function"""
+
+        # Uncompiled versions are retained so that other functions can be composed from them
+        # before compilation (rather than nesting jitted calls)
+        self._logll_func = logll
+        self._logprior_func = logprior
+        self._logposterior_func = logposterior
+
+        self._loglikelihood_jit = jit(logll)
+        self.loglikelihood = self._loglikelihood_jit
+        self.logprior = jit(logprior)
+        self._logposterior_jit = jit(logposterior)
+        self.logposterior = self._logposterior_jit
+
+        self._loglikelihood_batch = jit(vmap(lambda kwargs: logll(**kwargs)))
+        self._logposterior_batch = jit(vmap(lambda kwargs: logposterior(**kwargs)))
+
+        logposterior_vg = value_and_grad(lambda params: logposterior(**params))
+        self._logposterior_and_grad = jit(logposterior_vg)
+        self._logposterior_and_grad_batch = jit(vmap(logposterior_vg))
+
+        self._build_transform_funcs()
+
+    def _build_transform_funcs(self):
+        self.transforms = {k: p.get_transform() for k, p in self.priors.items()}
+        logposterior = self._logposterior_func
+
+        def logposterior_unconstrained(z: dict):
+            lp = 0.0
+            params = {}
+            for k, t in self.transforms.items():
+                params[k] = t.inverse(z[k])
+                lp += jnp.sum(t.inverse_log_det_jacobian(z[k]))
+            return logposterior(**params) + lp
+
+        logposterior_unconstrained.__doc__ = """logposterior_unconstrained(z)\n
+        Return the logposterior (including the Jacobian correction) for a dict z of
+        unconstrained parameter values; see bcm.to_unconstrained and bcm.from_unconstrained"""
+
+        self.logposterior_unconstrained = jit(logposterior_unconstrained)
+        self.logposterior_unconstrained_and_grad = jit(value_and_grad(logposterior_unconstrained))
+
+    def to_unconstrained(self, parameters: dict) -> dict:
+        """Map parameters from the support of their priors to the real line
+
+        Args:
+            parameters: Dict of parameter key/values (as specified in priors)
+
+        Returns:
+            Dict of unconstrained values
+        """
+        return {k: t.forward(parameters[k]) for k, t in self.transforms.items()}
+
+    def from_unconstrained(self, z: dict) -> dict:
+        """Map unconstrained values back to the support of their priors
+
+        Args:
+            z: Dict of unconstrained values, as returned by to_unconstrained
+
+        Returns:
+            Dict of parameter key/values
+        """
+        return {k: t.inverse(z[k]) for k, t in self.transforms.items()}
+
+    @property
+    def _full_runner(self):
+        if self._full_runner_obj is None:
+            # Only one thread may set the (shared) model's whitelist and build the runner
+            with self._build_lock:
+                if self._full_runner_obj is None:
+                    dyn_params, backend_args, whitelist = self._full_runner_args
+                    start = perf_counter()
+                    # The first use may be inside a trace (ie jit(bcm.run_jax)); the model's
+                    # constants must still be computed concretely
+                    with jax.ensure_compile_time_eval():
+                        self.model.set_derived_outputs_whitelist(whitelist)
+                        runner = self.model.get_runner(
+                            self.parameters, dyn_params, include_full_outputs=False, **backend_args
+                        )
+                    self._full_runner_obj = runner
+                    self.build_times["full_runner"] = perf_counter() - start
+        return self._full_runner_obj
+
+    @property
+    def _logll_multi(self):
+        if self._logll_multi_func is None:
+            with self._build_lock:
+                if self._logll_multi_func is None:
+                    start = perf_counter()
+                    self._logll_multi_func = self._build_logll_multi()
+                    self.build_times["logll_multi"] = perf_counter() - start
+        return self._logll_multi_func
+
+    # Locks cannot be pickled; recreate on unpickling (ie when sent to a worker process)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_build_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_lock = RLock()
+
+    def build_runners(self):
+        """Build the components which are otherwise constructed on first use by run/run_jax;
+        call before forking or timing workers to move this cost up front
+        """
+        self._full_runner
+        self._logll_multi
+
+    def _build_logll_multi(self):
+        extra_ll = self._extra_ll
+
         @jit
         def logll_multi(modelled_do, **kwargs):
-            out_ll = {}
+            target_ll = {}
+
+            for stacked in self._stacked_evaluators:
+                components = stacked.evaluate_components(modelled_do, kwargs)
+                for i, tname in enumerate(stacked.names):
+                    target_ll[tname] = components[i]
 
-            for tname, target in self.targets.items():
-                model_key = target.model_key
-                evaluator = self._evaluators[tname]
-                modelled = modelled_do[model_key]
-                out_ll[tname] = evaluator(modelled, kwargs)
+            for tname, evaluator in self._unstacked_evaluators.items():
+                modelled = modelled_do[evaluator.target.model_key]
+                target_ll[tname] = evaluator.evaluate(modelled, kwargs)
+
+            out_ll = {tname: target_ll[tname] for tname in self.targets}
 
             if extra_ll:
                 out_ll["extra_ll"] = extra_ll(kwargs)
 
             return out_ll
 
-        self._logll_multi = logll_multi
-        self.loglikelihood = logll
+        return logll_multi
+
+    def enable_cache(self, max_entries: int = 1024, max_bytes: Optional[int] = None):
+        """Memoize the results of run, loglikelihood and logposterior in a bounded LRU cache
+        keyed by parameter values, such that repeated evaluations do not rerun the model
+        Note that cached ResultsData are shared between calls, and should not be modified
+
+        Args:
+            max_entries: Maximum number of cached results
+            max_bytes (optional): Maximum (estimated) total size of cached results
+        """
+        from .utils.memo import LRUCache
+
+        self._cache = LRUCache(max_entries, max_bytes)
+        self.loglikelihood = self._cached_loglikelihood
+        self.logposterior = self._cached_logposterior
+
+    def disable_cache(self):
+        """Disable and discard the cache set by enable_cache"""
+        self._cache = None
+        self.loglikelihood = self._loglikelihood_jit
+        self.logposterior = self._logposterior_jit
+
+    def cache_info(self):
+        """Return hit/miss and size statistics for the cache set by enable_cache
+
+        Returns:
+            CacheInfo, or None if caching is not enabled
+        """
+        return self._cache.info() if self._cache is not None else None
+
+    def _cached_loglikelihood(self, **parameters):
+        return self._cached_call("loglikelihood", self._loglikelihood_jit, parameters)
+
+    def _cached_logposterior(self, **parameters):
+        return self._cached_call("logposterior", self._logposterior_jit, parameters)
 
-    def logprior(self, **parameters):
-        lp = 0.0
-        for k, p in self.priors.items():
-            lp += np.sum(p.logpdf(parameters[k]))
-        return lp
+    def _cached_call(self, name: str, func, parameters: dict):
+        # Traced values (ie calls from within other jitted functions) cannot be hashed
+        if any(isinstance(v, jax.core.Tracer) for v in parameters.values()):
+            return func(**parameters)
 
-    def logposterior(self, **parameters):
-        return self.loglikelihood(**parameters) + self.logprior(**parameters)
+        from .utils.memo import hash_parameters
+
+        key = hash_parameters(parameters, name)
+        found, value = self._cache.get(key)
+        if not found:
+            value = func(**parameters)
+            self._cache.put(key, value, 8)
+        return value
+
+    def _get_reference_parameters(self) -> dict:
+        return {
+            k: p.ppf(0.5) if p.size == 1 else p.ppf(np.repeat(0.5, p.size))
+            for k, p in self.priors.items()
+        }
+
+    def precompile(self, parameters: Optional[dict] = None):
+        """Trigger compilation of loglikelihood and logposterior, such that the cost is paid
+        up front (at worker start-up) rather than on the first evaluation.  When the persistent
+        compilation cache is enabled (see estival.utils.compile_cache), this loads the
+        executables from disk where available
+
+        Args:
+            parameters (optional): Parameters to compile with; defaults to the prior medians
+        """
+        if parameters is None:
+            parameters = self._get_reference_parameters()
+        jax.block_until_ready(self.loglikelihood(**parameters))
+        jax.block_until_ready(self.logposterior(**parameters))
+
+    def _get_batch_components(self, samples) -> dict:
+        """Return a dict of (n_samples, ...) arrays, keyed by prior name, for any
+        sample container supported by bcm.sample.convert (or a dict of stacked arrays)
+        """
+        if not isinstance(samples, dict):
+            samples = self.sample.convert(samples).components
+        return {k: jnp.asarray(samples[k]) for k in self.priors}
+
+    def loglikelihood_batch(self, samples, batch_size: Optional[int] = None) -> np.ndarray:
+        """Evaluate the loglikelihood for a batch of samples using a single vectorized
+        (vmapped) call of the jitted likelihood, rather than one Python call per sample
+
+        Args:
+            samples: A 2D array (n_samples, n_params), SampleIterator, or other sample container
+            batch_size (optional): Maximum number of samples evaluated per call; limits the
+                                   memory used by the vectorized model runs
+
+        Returns:
+            Array of loglikelihood values, one per sample
+        """
+        components = self._get_batch_components(samples)
+        return _eval_batched(self._loglikelihood_batch, components, batch_size)
+
+    def logposterior_batch(self, samples, batch_size: Optional[int] = None) -> np.ndarray:
+        """Evaluate the logposterior for a batch of samples; see loglikelihood_batch
+
+        Args:
+            samples: A 2D array (n_samples, n_params), SampleIterator, or other sample container
+            batch_size (optional): Maximum number of samples evaluated per call
+
+        Returns:
+            Array of logposterior values, one per sample
+        """
+        components = self._get_batch_components(samples)
+        return _eval_batched(self._logposterior_batch, components, batch_size)
+
+    def logposterior_and_grad(self, parameters: dict) -> Tuple[jnp.ndarray, dict]:
+        """Evaluate the logposterior and its gradient with respect to all prior parameters,
+        for use with gradient-based samplers and optimizers
+
+        Args:
+            parameters: Dict of parameter key/values (as specified in priors)
+
+        Returns:
+            Tuple of (logposterior, gradient), where gradient is a dict keyed by prior name
+        """
+        params = {k: jnp.asarray(parameters[k], dtype=float) for k in self.priors}
+        return self._logposterior_and_grad(params)
+
+    def logposterior_and_grad_batch(
+        self, samples, batch_size: Optional[int] = None
+    ) -> Tuple[np.ndarray, dict]:
+        """Evaluate the logposterior and its gradient for a batch of samples in a single
+        vectorized call; see logposterior_and_grad
+
+        Args:
+            samples: A 2D array (n_samples, n_params), SampleIterator, or other sample container
+            batch_size (optional): Maximum number of samples evaluated per call
+
+        Returns:
+            Tuple of (logposterior, gradient), where logposterior is an array of length n_samples
+            and gradient is a dict of (n_samples, ...) arrays keyed by prior name
+        """
+        components = {k: v.astype(float) for k, v in self._get_batch_components(samples).items()}
+        return _eval_batched(self._logposterior_and_grad_batch, components, batch_size)
 
     def run(self, parameters: dict, include_extras=True, include_outputs=True) -> ResultsData:
         """Run the model for a given set of parameters.
@@ -152,6 +448,14 @@ class BayesianCompartmentalModel:
         Returns:
             ResultsData, an extensible container with derived_outputs as a DataFrame
         """
+        if self._cache is not None:
+            from .utils.memo import hash_parameters
+
+            key = hash_parameters(parameters, "run", include_extras, include_outputs)
+            found, cached = self._cache.get(key)
+            if found:
+                return cached
+
         run_params = {k: v for k, v in parameters.items() if k in self._model_parameters}
         results = self._full_runner._run_func(run_params)
 
@@ -170,11 +474,76 @@ class BayesianCompartmentalModel:
         else:
             derived_outputs = None
 
-        return ResultsData(
+        results_data = ResultsData(
             derived_outputs=derived_outputs,
             extras=extras,
         )
 
+        if self._cache is not None:
+            nbytes = 0 if derived_outputs is None else int(derived_outputs.memory_usage().sum())
+            self._cache.put(key, results_data, nbytes)
+
+        return results_data
+
+    def _build_run_batch(self, include_extras: bool):
+        run_func = self._full_runner._run_func
+        logll_multi = self._logll_multi
+        logprior = self._logprior_func
+        model_parameters = self._model_parameters
+
+        def run_sample(parameters):
+            run_params = {k: v for k, v in parameters.items() if k in model_parameters}
+            derived_outputs = run_func(run_params)["derived_outputs"]
+
+            extras = {}
+            if include_extras:
+                ll_components = logll_multi(derived_outputs, **parameters)
+                extras["ll_components"] = ll_components
+                extras["loglikelihood"] = sum(ll_components.values())
+                extras["logprior"] = logprior(**parameters)
+                extras["logposterior"] = extras["logprior"] + extras["loglikelihood"]
+
+            return derived_outputs, extras
+
+        return jit(vmap(run_sample))
+
+    def run_batch(
+        self, samples, include_extras: bool = True, batch_size: Optional[int] = None
+    ) -> BatchResultsData:
+        """Run the model for a batch of samples in a single vectorized (vmapped) call,
+        returning stacked arrays rather than a DataFrame per sample
+
+        Args:
+            samples: A 2D array (n_samples, n_params), SampleIterator, or other sample container
+            include_extras: Include the likelihood extras (as per run)
+            batch_size (optional): Maximum number of samples evaluated per call
+
+        Returns:
+            BatchResultsData, with derived_outputs as an array of shape (sample, time, output)
+        """
+        if isinstance(samples, dict):
+            components = self._get_batch_components(samples)
+            index = pd.RangeIndex(len(next(iter(components.values()))), name="sample")
+        else:
+            samples = self.sample.convert(samples)
+            components = self._get_batch_components(samples.components)
+            index = samples.index
+
+        if include_extras not in self._run_batch_funcs:
+            self._run_batch_funcs[include_extras] = self._build_run_batch(include_extras)
+        batch_func = self._run_batch_funcs[include_extras]
+
+        derived_outputs, extras = _eval_batched(batch_func, components, batch_size)
+        outputs = list(derived_outputs)
+
+        return BatchResultsData(
+            derived_outputs=np.stack([derived_outputs[k] for k in outputs], axis=-1),
+            index=index,
+            times=self._ref_idx,
+            outputs=outputs,
+            extras=extras,
+        )
+
     def run_jax(self, parameters: dict) -> dict:
         """Run the jax run function for the model directly with the supplied parameters;
         meaning bcm.run_jax can be included in JIT calls
@@ -193,6 +562,21 @@ def capture_model_kwargs(model: CompartmentalModel, **kwargs) -> dict:
     return {k: kwargs[k] for k in kwargs if k in model_params}
 
 
+def _eval_batched(batch_func, components: dict, batch_size: Optional[int] = None):
+    """Call a vmapped function over components, in batches of at most batch_size samples,
+    returning the (possibly nested) outputs concatenated along the sample axis as numpy arrays
+    """
+    n_samples = len(next(iter(components.values())))
+    if batch_size is None or batch_size >= n_samples:
+        return jax.tree_util.tree_map(np.asarray, batch_func(components))
+
+    results = []
+    for start in range(0, n_samples, batch_size):
+        end = min(start + batch_size, n_samples)
+        results.append(batch_func({k: v[start:end] for k, v in components.items()}))
+    return jax.tree_util.tree_map(lambda *x: np.concatenate(x), *results)
+
+
 def _named_list_to_dict(in_list: list) -> dict:
     tdict = {}
 
@@ -6,6 +6,12 @@ from scipy import stats
 from scipy.optimize import minimize
 import pandas as pd
 
+import jax
+from jax import numpy as jnp
+from jax import scipy as jsp
+
+from .transforms import Transform, get_support_transform
+
 # pymc is optional - just be silent on failed import
 try:
     import pymc as pm
@@ -91,6 +97,39 @@ class BasePrior(ABC):
         """
         return self._rv.logpdf(x)
 
+    def logpdf_jax(self, x):
+        """Log Probability Density Function at x, implemented in jax such that it can
+        be jitted, vmapped and differentiated as part of a BayesianCompartmentalModel
+
+        Args:
+            x: Value (float or arraylike) at which to evaluate logpdf
+
+        Returns:
+            typeof(x): The logpdf values
+        """
+        # Fall back to the scipy implementation via a host callback; this can still be jitted
+        # (and vmapped, sequentially), but not differentiated - subclasses should override
+        x = jnp.asarray(x, dtype=jnp.result_type(float))
+        result_shape = jax.ShapeDtypeStruct(x.shape, x.dtype)
+
+        def scipy_logpdf(v):
+            return np.asarray(self.logpdf(v), dtype=result_shape.dtype)
+
+        try:
+            return jax.pure_callback(scipy_logpdf, result_shape, x, vmap_method="sequential")
+        except TypeError:
+            # jax < 0.4.34 does not support vmap_method (and is sequential by default)
+            return jax.pure_callback(scipy_logpdf, result_shape, x)
+
+    def get_transform(self) -> Transform:
+        """Return the Transform between this prior's support and the real line, as used
+        for evaluating the posterior in unconstrained space
+
+        Returns:
+            The Transform (log, logit or identity, depending on the bounds of the support)
+        """
+        return get_support_transform(self.bounds())
+
     def get_series(self, func_name, ci=0.99, slen=101):
         x = np.linspace(*self.finite_bounds(ci=ci), slen)
         y = getattr(self._rv, func_name)(x)
@@ -156,6 +195,9 @@ class BetaPrior(BasePrior):
     def to_pymc(self):
         return pm.Beta(self.name, alpha=self.a, beta=self.b, shape=self._get_pymc_shape())
 
+    def logpdf_jax(self, x):
+        return jsp.stats.beta.logpdf(x, self.a, self.b)
+
     @classmethod
     def _get_test(cls):
         return cls("test", 2.0, 5.0)
@@ -197,6 +239,9 @@ class UniformPrior(BasePrior):
                 shape=self._get_pymc_shape(),
             )
 
+    def logpdf_jax(self, x):
+        return jsp.stats.uniform.logpdf(x, self.start, self.end - self.start)
+
     def __repr__(self):
         return f"{super().__repr__()} {{bounds: {self.bounds()}}}"
 
@@ -235,6 +280,15 @@ class TruncNormalPrior(BasePrior):
             shape=self._get_pymc_shape(),
         )
 
+    def logpdf_jax(self, x):
+        return jsp.stats.truncnorm.logpdf(
+            x,
+            self.distri_params["a"],
+            self.distri_params["b"],
+            loc=self.mean,
+            scale=self.stdev,
+        )
+
     def __repr__(self):
         return f"{super().__repr__()} {{mean: {self.mean}, stdev: {self.stdev}, bounds: {self.bounds()}}}"
 
@@ -265,6 +319,9 @@ class NormalPrior(BasePrior):
             shape=self._get_pymc_shape(),
         )
 
+    def logpdf_jax(self, x):
+        return jsp.stats.norm.logpdf(x, loc=self.mean, scale=self.stdev)
+
     def __repr__(self):
         return f"{super().__repr__()} {{mean: {self.mean}, stdev: {self.stdev}}}"
 
@@ -291,6 +348,9 @@ class GammaPrior(BasePrior):
 
         return pm.Gamma(self.name, alpha=alpha, beta=beta, shape=self._get_pymc_shape())
 
+    def logpdf_jax(self, x):
+        return jsp.stats.gamma.logpdf(x, self.shape, scale=self.scale)
+
     @classmethod
     def from_mode(
         cls,
@@ -1,17 +1,23 @@
 from types import ClassMethodDescriptorType
-from typing import Tuple, Dict, Optional, Union
+from typing import List, Tuple, Dict, Optional, Sequence, Union
 from multiprocessing import cpu_count
 from dataclasses import dataclass
 from pathlib import Path
+import json
+import hashlib
+import os
+import pickle
+import threading
 
 import pandas as pd
 from arviz import InferenceData
 import numpy as np
+import jax
 
 import xarray
 
 from estival.model import BayesianCompartmentalModel, ResultsData
-from estival.utils.parallel import map_parallel
+from estival.utils.parallel import map_parallel, WorkerPool
 from estival.utils.sample import convert_sample_type, get_prior_sizeinfo, _lod_to_si, SampleTypes
 
 SampleIndex = Tuple[int, int]
@@ -19,11 +25,175 @@ ParamDict = Dict[str, float]
 SampleContainer = Union[pd.DataFrame, "SampleIterator", xarray.Dataset]
 
 
+@dataclass
+class ResultsArray:
+    """A compact container for sampled model outputs, backed by a single dense array with
+    axes (variable, time, sample); use to_dataframe for the layout of model_results_for_samples
+    """
+
+    data: np.ndarray
+    variables: List[str]
+    times: pd.Index
+    samples: pd.Index
+
+    def __getitem__(self, variable: str) -> pd.DataFrame:
+        """Return the outputs of a single variable as a (time, sample) DataFrame"""
+        return pd.DataFrame(
+            self.data[self.variables.index(variable)], index=self.times, columns=self.samples
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+    def astype(self, dtype) -> "ResultsArray":
+        return ResultsArray(self.data.astype(dtype), self.variables, self.times, self.samples)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Return a DataFrame with time as index and [variable, *sample levels] as columns,
+        as per model_results_for_samples
+        """
+        return _results_df_from_array(self.data, self.variables, self.times, self.samples)
+
+    @classmethod
+    def from_dataframe(cls, results_df: pd.DataFrame, dtype=None) -> "ResultsArray":
+        """Build a ResultsArray from a DataFrame in the layout of model_results_for_samples
+
+        Args:
+            results_df: The results DataFrame
+            dtype (optional): Storage dtype (ie np.float32); defaults to that of results_df
+        """
+        variables = list(dict.fromkeys(results_df.columns.get_level_values(0)))
+        samples = results_df[variables[0]].columns
+        data = np.stack([results_df[v][samples].to_numpy(dtype=dtype) for v in variables])
+        return cls(data, variables, results_df.index, samples)
+
+    def quantiles(self, quantiles: Tuple[float]) -> pd.DataFrame:
+        """Compute quantiles over samples, as per quantiles_for_results
+
+        Args:
+            quantiles: Quantiles to compute [0.0,1.0]
+
+        Returns:
+            pd.DataFrame: DataFrame with time as index and [variable, quantile] as columns
+        """
+        # Shape (quantile, variable, time) -> (time, variable * quantile)
+        qvals = np.quantile(self.data, quantiles, axis=-1)
+        n_q, n_vars, n_times = qvals.shape
+        columns = pd.MultiIndex.from_product(
+            (self.variables, quantiles), names=["variable", "quantile"]
+        )
+        return pd.DataFrame(
+            qvals.transpose(2, 1, 0).reshape(n_times, n_vars * n_q),
+            index=self.times,
+            columns=columns,
+        )
+
+
 @dataclass
 class SampledResults:
-    results: pd.DataFrame
+    results: Union[pd.DataFrame, ResultsArray]
     extras: Optional[pd.DataFrame]
 
+    def to_arrow(self):
+        """Convert results to a pyarrow Table in 'long' layout, with one row per
+        (sample, time) and one column per variable
+
+        Returns:
+            pyarrow.Table
+        """
+        import pyarrow as pa
+
+        results = self.results
+        if not isinstance(results, ResultsArray):
+            results = ResultsArray.from_dataframe(results)
+        variables, sample_index = results.variables, results.samples
+        levels = list(_get_index_levels(sample_index))
+        n_times, n_samples = len(results.times), len(sample_index)
+
+        arrays = {}
+        for i, level in enumerate(levels):
+            arrays[level] = np.repeat(sample_index.get_level_values(i).to_numpy(), n_times)
+        arrays["time"] = np.tile(results.times.to_numpy(), n_samples)
+        for i, v in enumerate(variables):
+            arrays[v] = results.data[i].T.ravel()
+
+        metadata = {"levels": levels, "variables": variables, "n_times": n_times}
+        table = pa.table(arrays)
+        return table.replace_schema_metadata({"estival": json.dumps(metadata)})
+
+    @classmethod
+    def from_arrow(
+        cls, table, extras: Optional[pd.DataFrame] = None, as_array: bool = False
+    ) -> "SampledResults":
+        """Build SampledResults from a pyarrow Table written by to_arrow
+
+        Args:
+            table: pyarrow.Table
+            extras (optional): Extras DataFrame
+            as_array: Return results as a ResultsArray rather than a DataFrame
+
+        Returns:
+            SampledResults
+        """
+        metadata = json.loads(table.schema.metadata[b"estival"])
+        levels, variables = metadata["levels"], metadata["variables"]
+
+        time = table.column("time").to_numpy()
+        n_times = metadata["n_times"]
+        n_samples = len(time) // n_times
+
+        level_values = [table.column(level).to_numpy()[::n_times] for level in levels]
+        if len(levels) == 1:
+            sample_index = pd.Index(level_values[0], name=levels[0])
+        else:
+            sample_index = pd.MultiIndex.from_arrays(level_values, names=levels)
+        time_index = pd.Index(time[:n_times], name="time")
+
+        data = np.stack(
+            [table.column(v).to_numpy().reshape(n_samples, n_times).T for v in variables]
+        )
+        results = ResultsArray(data, variables, time_index, sample_index)
+        return cls(results if as_array else results.to_dataframe(), extras)
+
+    def to_parquet(
+        self, results_file: Union[Path, str], extras_file: Optional[Union[Path, str]] = None
+    ):
+        """Write results (and optionally extras) to Parquet files; see to_arrow for layout
+
+        Args:
+            results_file: Path of the results file
+            extras_file (optional): Path of the extras file
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(self.to_arrow(), results_file)
+        if extras_file is not None and self.extras is not None:
+            pq.write_table(pa.Table.from_pandas(self.extras), extras_file)
+
+    @classmethod
+    def read_parquet(
+        cls,
+        results_file: Union[Path, str],
+        extras_file: Optional[Union[Path, str]] = None,
+        as_array: bool = False,
+    ) -> "SampledResults":
+        """Read SampledResults written by to_parquet
+
+        Args:
+            results_file: Path of the results file
+            extras_file (optional): Path of the extras file
+            as_array: Return results as a ResultsArray rather than a DataFrame
+
+        Returns:
+            SampledResults
+        """
+        import pyarrow.parquet as pq
+
+        extras = pq.read_table(extras_file).to_pandas() if extras_file is not None else None
+        return cls.from_arrow(pq.read_table(results_file), extras, as_array)
+
 
 @dataclass
 class _PriorStub:
@@ -34,17 +204,26 @@ def likelihood_extras_for_idata(
     idata: InferenceData,
     bcm: BayesianCompartmentalModel,
     num_workers: Optional[int] = None,
-    exec_mode: str = "thread",
+    exec_mode: Union[str, WorkerPool] = "thread",
+    previous_extras: Optional[pd.DataFrame] = None,
+    cache_file: Optional[Union[Path, str]] = None,
 ) -> pd.DataFrame:
     """Calculate the likelihood extras (ll,lprior,lpost + per-target) for all
     samples in supplied InferenceData, returning a DataFrame.
 
     Note - input InferenceData must be the full (unburnt) idata
 
+    For idata that grows over time (ie checkpoints of a running sampler), supply the
+    output of a previous call as previous_extras (or use cache_file), and only draws
+    not already present in it will be evaluated
+
     Args:
         idata: The InferenceData to sample
         bcm: The BayesianCompartmentalModel (must be the same BCM used to generate idata)
         num_workers: Number of multiprocessing workers to use; defaults to cpu_count/2
+        previous_extras (optional): Output of a previous call for an earlier version of idata
+        cache_file (optional): HDF file from which previous_extras is loaded (if it exists and
+                               previous_extras is not supplied), and to which results are saved
 
     Returns:
         A DataFrame with index (chain, draw) and columns being the keys in ResultsData.extras
@@ -63,30 +242,43 @@ def likelihood_extras_for_idata(
     accept_mask = accepted_s.data
     posterior_t = idata["posterior"].transpose("chain", "draw", ...)
 
-    components = {}
-    for dv in posterior_t.data_vars:
-        components[dv] = posterior_t[dv].data[accept_mask]
+    if previous_extras is None and cache_file is not None and Path(cache_file).exists():
+        previous_extras = pd.read_hdf(cache_file, "extras")  # type: ignore
 
-    accepted_si = SampleIterator(components, index=accepted_index)
-    # Get the likelihood extras for all accepted samples - this spins up a multiprocessing pool
-    # pres = sample_likelihood_extras_mp(bcm, accepted_samples_df, n_workers)
+    # Only evaluate accepted draws that are not already present in previous_extras
+    if previous_extras is not None:
+        new_mask = ~accepted_index.isin(previous_extras.index)
+    else:
+        new_mask = np.ones(len(accepted_index), dtype=bool)
 
-    extras_df = likelihood_extras_for_samples(accepted_si, bcm, num_workers, exec_mode=exec_mode)
+    components = {}
+    for dv in posterior_t.data_vars:
+        components[dv] = posterior_t[dv].data[accept_mask][new_mask]
+
+    extras_dfs = []
+    if previous_extras is not None:
+        extras_dfs.append(previous_extras.loc[accepted_index[~new_mask]])
+
+    if new_mask.any():
+        accepted_si = SampleIterator(components, index=accepted_index[new_mask])
+        # Get the likelihood extras for all accepted samples - this spins up a multiprocessing pool
+        # pres = sample_likelihood_extras_mp(bcm, accepted_samples_df, n_workers)
+        extras_dfs.append(
+            likelihood_extras_for_samples(accepted_si, bcm, num_workers, exec_mode=exec_mode)
+        )
 
-    # Collate this into an array - it's much much faster than dealing with pandas directly
-    tmp_extras = np.empty((len(accepted_df), extras_df.shape[-1]))
+    extras_df = pd.concat(extras_dfs)
 
-    # This value should never get used - we know something went wrong if the accepted field if it did
-    last_good_sample_idx = "IndexNotSet"
+    # Forward fill rejected draws with the last accepted draw of their chain (ala MCMC)
+    # The last accepted draw is the running maximum of accepted draw positions along each chain,
+    # which we map to rows of the (chain-major, accepted only) extras array
+    accept_mask = np.asarray(accept_mask, dtype=bool)
+    n_chains, n_draws = accept_mask.shape
+    last_accepted = np.maximum.accumulate(np.where(accept_mask, np.arange(n_draws), 0), axis=1)
+    accepted_rows = np.cumsum(accept_mask.ravel()) - 1
+    fill_rows = accepted_rows[(np.arange(n_chains)[:, None] * n_draws + last_accepted).ravel()]
 
-    for i, (idx, accepted_s) in enumerate(accepted_df.iterrows()):
-        # Extract the bool from the Series
-        accepted = accepted_s["accepted"]
-        # Update the index if this sample is accepted - otherwise we'll
-        # store the previous known good sample (ala MCMC)
-        if accepted:
-            last_good_sample_idx = idx
-        tmp_extras[i] = extras_df.loc[last_good_sample_idx]
+    tmp_extras = extras_df.reindex(accepted_index).to_numpy()[fill_rows]
 
     # Create a DataFrame with the full index of the idata
     # This has a lot of redundant information, but it's still only a few Mb and
@@ -95,6 +287,9 @@ def likelihood_extras_for_idata(
         index=accepted_df.index, columns=extras_df.columns, data=tmp_extras, dtype=float
     )
 
+    if cache_file is not None:
+        filled_edf.to_hdf(cache_file, key="extras", mode="w")
+
     return filled_edf
 
 
@@ -124,12 +319,141 @@ def _extras_df_from_pres(pres, is_full_data=False, index_names=("chain", "draw")
     return extras_df
 
 
+def _stack_chunk_params(chunk: List[Tuple[SampleIndex, ParamDict]]) -> dict:
+    """Stack the parameter dicts of a chunk of (index, params) items into arrays
+    with a leading sample axis, as expected by BayesianCompartmentalModel.run_batch
+    """
+    params = [p for _, p in chunk]
+    return {k: np.stack([p[k] for p in params]) for k in params[0]}
+
+
+def _unstack_extras(extras: dict, i: int) -> dict:
+    """Return the (possibly nested) extras of sample i from batched extras"""
+    return {k: _unstack_extras(v, i) if isinstance(v, dict) else v[i] for k, v in extras.items()}
+
+
+def _map_samples(
+    run_func,
+    samples: "SampleIterator",
+    num_workers: Optional[int],
+    exec_mode,
+    chunksize: Optional[int] = None,
+    batch_func=None,
+    checkpoint: Optional[Union[str, Path]] = None,
+    checkpoint_every: int = 1000,
+    resume: bool = False,
+    checkpoint_meta: Optional[dict] = None,
+    shared: Sequence = (),
+) -> list:
+    """map_parallel run_func over samples.iterrows(), optionally checkpointing completed
+    blocks of checkpoint_every samples to the checkpoint directory, such that an interrupted
+    run can be resumed (blocks are run in turn, so at most one block is recomputed)
+    When checkpointing, a single pool of workers (initialized with shared) is used for all
+    blocks in 'process', 'hybrid' and 'distributed' modes, rather than one per block
+
+    Returns:
+        List of run_func results, in sample order
+    """
+    if checkpoint is None:
+        return map_parallel(
+            run_func,
+            samples.iterrows(),
+            num_workers,
+            mode=exec_mode,
+            chunksize=chunksize,
+            batch_func=batch_func,
+        )
+
+    checkpoint = Path(checkpoint)
+    checkpoint.mkdir(parents=True, exist_ok=True)
+    n_samples = len(samples.index)
+
+    index_hash = hashlib.sha1(pickle.dumps(list(samples.index))).hexdigest()
+    meta = {"n_samples": n_samples, "index": index_hash, "checkpoint_every": checkpoint_every}
+    meta.update(checkpoint_meta or {})
+    meta_file = checkpoint / "checkpoint.json"
+    if resume and meta_file.exists():
+        prev_meta = json.loads(meta_file.read_text())
+        if prev_meta != meta:
+            raise ValueError("Checkpoint does not match this run", prev_meta, meta)
+    else:
+        for f in checkpoint.glob("block_*.pkl"):
+            f.unlink()
+        meta_file.write_text(json.dumps(meta))
+
+    pool = None
+    if exec_mode in ["process", "hybrid"]:
+        pool = WorkerPool(n_workers=num_workers, mode=exec_mode, shared=shared)  # type: ignore
+    elif exec_mode == "distributed":
+        from estival.utils.distributed import DistributedPool
+
+        pool = DistributedPool(shared=shared, n_local_workers=num_workers or cpu_count())
+    mode = pool if pool is not None else exec_mode
+
+    pres = []
+    try:
+        for start in range(0, n_samples, checkpoint_every):
+            block_file = checkpoint / f"block_{start:010d}.pkl"
+            if resume and block_file.exists():
+                with open(block_file, "rb") as f:
+                    pres += pickle.load(f)
+                continue
+
+            block = samples.iloc[start : start + checkpoint_every]
+            block_pres = map_parallel(
+                run_func,
+                block.iterrows(),
+                num_workers,
+                mode=mode,
+                chunksize=chunksize,
+                batch_func=batch_func,
+            )
+
+            # Write then rename, so that a partially written block is never resumed from
+            tmp_file = block_file.with_suffix(".tmp")
+            with open(tmp_file, "wb") as f:
+                pickle.dump(block_pres, f)
+            os.replace(tmp_file, block_file)
+
+            pres += block_pres
+    finally:
+        if pool is not None:
+            pool.close()
+
+    return pres
+
+
 def likelihood_extras_for_samples(
     samples: SampleContainer,
     bcm: BayesianCompartmentalModel,
     num_workers: Optional[int] = None,
-    exec_mode: Optional[str] = "thread",
+    exec_mode: Optional[Union[str, WorkerPool]] = "thread",
+    chunksize: Optional[int] = None,
+    batched: bool = False,
+    checkpoint: Optional[Union[str, Path]] = None,
+    checkpoint_every: int = 1000,
+    resume: bool = False,
 ) -> pd.DataFrame:
+    """Compute the likelihood extras (loglikelihood, logprior etc) for all samples
+
+    Args:
+        samples: The samples to evaluate
+        bcm: The BayesianCompartmentalModel to evaluate
+        num_workers: Number of parallel workers
+        exec_mode: Parallel execution mode (see map_parallel)
+        chunksize (optional): Number of samples per parallel task (see map_parallel)
+        batched: Evaluate each chunk of samples with a single vectorized call
+                 (see BayesianCompartmentalModel.run_batch)
+        checkpoint (optional): Directory in which to save completed blocks of results, such
+                               that an interrupted run can be resumed
+        checkpoint_every: Number of samples per checkpointed block
+        resume: Reuse any blocks already completed in checkpoint (by a previous run with the
+                same samples and arguments); the output is identical to an uninterrupted run
+
+    Returns:
+        DataFrame of extras, indexed as per samples
+    """
+
     def get_sample_extras(sample_params: Tuple[SampleIndex, ParamDict]) -> Tuple[SampleIndex, dict]:
         """Run the BCM for a given set of parameters, and return its extras dictionary
         (likelihood, posterior etc)
@@ -149,7 +473,25 @@ def likelihood_extras_for_samples(
 
     # samples = validate_samplecontainer(samples)
 
-    pres = map_parallel(get_sample_extras, samples.iterrows(), num_workers, mode=exec_mode)
+    def get_batch_extras(
+        chunk: List[Tuple[SampleIndex, ParamDict]],
+    ) -> List[Tuple[SampleIndex, dict]]:
+        bres = bcm.run_batch(_stack_chunk_params(chunk), include_extras=True)
+        return [(idx, _unstack_extras(bres.extras, i)) for i, (idx, _) in enumerate(chunk)]
+
+    pres = _map_samples(
+        get_sample_extras,
+        samples,  # type: ignore
+        num_workers,
+        exec_mode,
+        chunksize,
+        get_batch_extras if batched else None,
+        checkpoint,
+        checkpoint_every,
+        resume,
+        {"kind": "extras"},
+        [bcm],
+    )
 
     if isinstance(samples.index, pd.MultiIndex):
         levels = samples.index.names
@@ -170,10 +512,46 @@ def model_results_for_samples(
     bcm: BayesianCompartmentalModel,
     include_extras: bool = True,
     num_workers: Optional[int] = None,
-    exec_mode: Optional[str] = "thread",
+    exec_mode: Optional[Union[str, WorkerPool]] = "thread",
+    as_array: bool = False,
+    dtype=np.float64,
+    chunksize: Optional[int] = None,
+    batched: bool = False,
+    checkpoint: Optional[Union[str, Path]] = None,
+    checkpoint_every: int = 1000,
+    resume: bool = False,
+    shared_memory: bool = False,
 ) -> SampledResults:
+    """Run the BCM for all samples, returning their derived outputs (and optionally extras)
+
+    Args:
+        samples: The samples to run
+        bcm: The BayesianCompartmentalModel to run
+        include_extras: Also return the likelihood extras for each sample
+        num_workers: Number of parallel workers
+        exec_mode: Parallel execution mode (see map_parallel)
+        as_array: Return results as a ResultsArray, rather than a DataFrame; this is much
+                  faster to build and slice for large numbers of samples
+        dtype: Storage dtype of results when as_array is True (ie np.float32 to halve memory)
+        chunksize (optional): Number of samples per parallel task (see map_parallel)
+        batched: Run each chunk of samples with a single vectorized call
+                 (see BayesianCompartmentalModel.run_batch)
+        checkpoint (optional): Directory in which to save completed blocks of results, such
+                               that an interrupted run can be resumed
+        checkpoint_every: Number of samples per checkpointed block
+        resume: Reuse any blocks already completed in checkpoint (by a previous run with the
+                same samples and arguments); the output is identical to an uninterrupted run
+        shared_memory: Have workers write derived outputs directly into a preallocated
+                       shared memory array, returning only their extras; this avoids pickling
+                       and copying outputs in 'process' and 'hybrid' modes.  Not supported
+                       with checkpoint, or in 'distributed' mode
+
+    Returns:
+        SampledResults
+    """
+
     def get_model_results(
-        sample_params: Tuple[SampleIndex, ParamDict]
+        sample_params: Tuple[SampleIndex, ParamDict],
     ) -> Tuple[SampleIndex, ResultsData]:
         """Run the BCM for a given set of parameters, and return its extras dictionary
         (likelihood, posterior etc)
@@ -192,9 +570,53 @@ def model_results_for_samples(
     # samples = validate_samplecontainer(samples)
     samples = bcm.sample.convert(samples)  # type: ignore
 
-    pres = map_parallel(get_model_results, samples.iterrows(), num_workers, mode=exec_mode)
+    def get_batch_results(
+        chunk: List[Tuple[SampleIndex, ParamDict]],
+    ) -> List[Tuple[SampleIndex, ResultsData]]:
+        bres = bcm.run_batch(_stack_chunk_params(chunk), include_extras=include_extras)
+        out = []
+        for i, (idx, _) in enumerate(chunk):
+            do_df = pd.DataFrame(bres.derived_outputs[i], index=bres.times, columns=bres.outputs)
+            out.append((idx, ResultsData(do_df, _unstack_extras(bres.extras, i))))
+        return out
 
-    df = pd.concat([p[1].derived_outputs for p in pres], keys=[p[0] for p in pres])
+    if shared_memory:
+        if checkpoint is not None:
+            raise ValueError("shared_memory cannot be combined with checkpoint")
+        data, variables, times, pres = _map_results_shared_memory(
+            samples, bcm, include_extras, num_workers, exec_mode, chunksize, batched  # type: ignore
+        )
+        levels = _get_index_levels(samples.index)
+        sample_index = samples.index.set_names(list(levels))
+        if as_array:
+            sample_index, order = sample_index.sort_values(return_indexer=True)
+            results = ResultsArray(
+                np.take(data, order, axis=2).astype(dtype, copy=False),
+                variables,
+                times,
+                sample_index,
+            )
+        else:
+            results = _results_df_from_array(data, variables, times, sample_index)
+        if include_extras:
+            extras_df = _extras_df_from_pres(pres, False, index_names=levels).sort_index()
+            return SampledResults(results, extras_df)
+        else:
+            return SampledResults(results, None)
+
+    pres = _map_samples(
+        get_model_results,
+        samples,  # type: ignore
+        num_workers,
+        exec_mode,
+        chunksize,
+        get_batch_results if batched else None,
+        checkpoint,
+        checkpoint_every,
+        resume,
+        {"kind": "results", "include_extras": include_extras},
+        [bcm],
+    )
 
     if isinstance(samples.index, pd.MultiIndex):
         levels = samples.index.names
@@ -207,19 +629,330 @@ def model_results_for_samples(
             name = "sample"
         levels = (name,)
 
-    df: pd.DataFrame = df.sort_index().unstack(level=unstack_levels)  # type: ignore
-    df.columns.set_names(["variable", *levels], inplace=True)
-    df.index.set_names("time", inplace=True)
+    if as_array:
+        df = _results_array_from_pres(pres, levels, dtype)
+    else:
+        df = pd.concat([p[1].derived_outputs for p in pres], keys=[p[0] for p in pres])
+        df: pd.DataFrame = df.sort_index().unstack(level=unstack_levels)  # type: ignore
+        df.columns.set_names(["variable", *levels], inplace=True)
+        df.index.set_names("time", inplace=True)
 
     if include_extras:
         extras_df: pd.DataFrame = _extras_df_from_pres(
             pres, True, index_names=levels
-        ).sort_index()  # type:ignore
+        ).sort_index()  # type: ignore
         return SampledResults(df, extras_df)
     else:
         return SampledResults(df, None)
 
 
+# Shared memory segments attached by this process, by name; workers attach once and reuse
+# the mapping for every sample they evaluate
+_shm_attached = {}
+_shm_lock = threading.Lock()
+
+
+def _attach_shared_memory(name: str):
+    from multiprocessing import shared_memory
+
+    try:
+        # Attaching processes should never unlink the segment (python >= 3.13)
+        return shared_memory.SharedMemory(name=name, track=False)  # type: ignore
+    except TypeError:
+        # Earlier versions register the segment again with the (shared) resource tracker of
+        # the multiprocessing workers, which is harmless; the parent unlinks it when done
+        return shared_memory.SharedMemory(name=name)
+
+
+def _get_shared_memory(name: str):
+    """Return this process's attachment to the shared memory segment name, attaching on
+    first use; attachments to the segments of earlier runs are released
+    """
+    with _shm_lock:
+        shm = _shm_attached.get(name)
+        if shm is None:
+            for stale in list(_shm_attached):
+                _shm_attached.pop(stale).close()
+            shm = _shm_attached[name] = _attach_shared_memory(name)
+        return shm
+
+
+def _write_shared_outputs(name: str, shape: tuple, positions, values: np.ndarray):
+    """Write values into rows (positions) of the (sample, time, variable) shared memory
+    array of the given name and shape
+    """
+    shm = _get_shared_memory(name)
+    out = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    out[positions] = values
+    del out
+
+
+def _map_results_shared_memory(
+    samples: "SampleIterator",
+    bcm: BayesianCompartmentalModel,
+    include_extras: bool,
+    num_workers: Optional[int],
+    exec_mode,
+    chunksize: Optional[int] = None,
+    batched: bool = False,
+):
+    """Run the BCM for all samples, with workers writing derived outputs into a shared memory
+    array (indexed by sample position) and returning only their extras
+
+    Returns:
+        Tuple of (data, variables, times, pres), where data is an array of shape
+        (variable, time, sample) in the order of samples, and pres is a list of (idx, extras)
+    """
+    from multiprocessing import shared_memory
+    from estival.utils.distributed import DistributedPool
+
+    if exec_mode == "distributed" or isinstance(exec_mode, DistributedPool):
+        raise ValueError("shared_memory requires all workers to run on this machine")
+
+    # Trace (rather than run) the model on the first sample to determine its output shape;
+    # the runner is built first, so that it is shared with any thread workers
+    bcm.build_runners()
+    _, ref_params = next(iter(samples.iterrows()))
+    ref_params = {k: v for k, v in ref_params.items() if k in bcm._model_parameters}
+    ref_do = jax.eval_shape(bcm.run_jax, ref_params)["derived_outputs"]
+    variables = list(ref_do)
+    times = bcm._ref_idx.rename("time")
+    shape = (len(samples.index), len(times), len(variables))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 8))
+    name = shm.name
+    # Thread workers share the parent's own mapping
+    with _shm_lock:
+        _shm_attached[name] = shm
+
+    def get_sample_results(
+        item: Tuple[int, Tuple[SampleIndex, ParamDict]],
+    ) -> Tuple[SampleIndex, dict]:
+        pos, (idx, params) = item
+        res = bcm.run(params, include_extras=include_extras)
+        _write_shared_outputs(name, shape, pos, res.derived_outputs[variables].to_numpy())
+        return idx, res.extras
+
+    def get_batch_results(
+        chunk: List[Tuple[int, Tuple[SampleIndex, ParamDict]]],
+    ) -> List[Tuple[SampleIndex, dict]]:
+        positions = [pos for pos, _ in chunk]
+        bres = bcm.run_batch(_stack_chunk_params([c[1] for c in chunk]), include_extras)
+        var_idx = [bres.outputs.index(v) for v in variables]
+        _write_shared_outputs(name, shape, positions, bres.derived_outputs[:, :, var_idx])
+        return [(idx, _unstack_extras(bres.extras, i)) for i, (_, (idx, _)) in enumerate(chunk)]
+
+    try:
+        pres = map_parallel(
+            get_sample_results,
+            enumerate(samples.iterrows()),
+            num_workers,
+            mode=exec_mode,
+            chunksize=chunksize,
+            batch_func=get_batch_results if batched else None,
+        )
+        shared = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        data = shared.transpose(2, 1, 0).copy()
+        del shared
+    finally:
+        with _shm_lock:
+            _shm_attached.pop(name, None)
+        shm.close()
+        shm.unlink()
+
+    return data, variables, times, pres
+
+
+def _results_array_from_pres(pres, levels, dtype=np.float64) -> ResultsArray:
+    """Build a ResultsArray (with samples in sorted order) from a list of (idx, ResultsData)"""
+    ref_do = pres[0][1].derived_outputs
+    variables = list(ref_do.columns)
+
+    keys = [p[0] for p in pres]
+    if len(levels) > 1:
+        samples = pd.MultiIndex.from_tuples(keys, names=levels)
+    else:
+        samples = pd.Index(keys, name=levels[0])
+    samples, order = samples.sort_values(return_indexer=True)
+
+    data = np.empty((len(variables), len(ref_do.index), len(pres)), dtype=dtype)
+    for i, pi in enumerate(order):
+        data[:, :, i] = pres[pi][1].derived_outputs[variables].to_numpy().T
+
+    return ResultsArray(data, variables, ref_do.index.rename("time"), samples)
+
+
+def _get_index_levels(index: pd.Index) -> tuple:
+    if isinstance(index, pd.MultiIndex):
+        return tuple(index.names)
+    else:
+        return (index.name or "sample",)
+
+
+def _iter_results_chunks(
+    samples: "SampleIterator",
+    bcm: BayesianCompartmentalModel,
+    chunk_size: int,
+    include_extras: bool = True,
+    num_workers: Optional[int] = None,
+    exec_mode: Optional[Union[str, WorkerPool]] = "thread",
+):
+    """Run the BCM for successive chunks of samples, such that only one chunk of results
+    is held in memory at a time
+
+    Returns:
+        Generator of (chunk_index, variables, outputs, extras_df), where outputs is an
+        array of shape (variable, time, sample) and extras_df is None if not include_extras
+    """
+
+    def get_model_results(
+        sample_params: Tuple[SampleIndex, ParamDict],
+    ) -> Tuple[SampleIndex, ResultsData]:
+        idx, params = sample_params
+        res = bcm.run(params, include_extras=include_extras)
+        return idx, res
+
+    levels = _get_index_levels(samples.index)
+
+    for start in range(0, len(samples.index), chunk_size):
+        chunk = samples.iloc[start : start + chunk_size]
+        pres = map_parallel(get_model_results, chunk.iterrows(), num_workers, mode=exec_mode)
+
+        variables = list(pres[0][1].derived_outputs.columns)
+        outputs = np.stack([p[1].derived_outputs[variables].to_numpy().T for p in pres], axis=-1)
+
+        if include_extras:
+            extras_df = _extras_df_from_pres(pres, True, index_names=levels)
+        else:
+            extras_df = None
+
+        yield chunk.index, variables, outputs, extras_df
+
+
+def model_results_to_hdf5(
+    samples: SampleContainer,
+    bcm: BayesianCompartmentalModel,
+    out_file: Union[Path, str],
+    include_extras: bool = True,
+    chunk_size: int = 1000,
+    num_workers: Optional[int] = None,
+    exec_mode: Optional[Union[str, WorkerPool]] = "thread",
+):
+    """Equivalent to model_results_for_samples, but streaming the results to an HDF5 file
+    chunk by chunk, such that peak memory is bounded by chunk_size rather than the number
+    of samples.  Outputs are stored as a single dataset with layout (variable, time, sample);
+    use load_results_hdf5 to read them back
+
+    Args:
+        samples: The samples to run
+        bcm: The BayesianCompartmentalModel to run
+        out_file: Path of the HDF5 file to write (overwritten if it exists)
+        include_extras: Also store the likelihood extras for each sample
+        chunk_size: Number of samples run (and held in memory) at a time
+        num_workers: Number of parallel workers
+        exec_mode: Parallel execution mode (see map_parallel)
+    """
+    import h5py
+
+    samples = bcm.sample.convert(samples)  # type: ignore
+    n_samples = len(samples.index)
+
+    with h5py.File(out_file, "w") as f:
+        _write_index_hdf5(f, "sample", samples.index)
+        _write_index_hdf5(f, "time", bcm._ref_idx.rename("time"))
+
+        results_ds = None
+        extras_ds = None
+
+        chunks = _iter_results_chunks(
+            samples, bcm, chunk_size, include_extras, num_workers, exec_mode
+        )
+        start = 0
+        for chunk_index, variables, outputs, extras_df in chunks:
+            end = start + len(chunk_index)
+
+            if results_ds is None:
+                n_vars, n_times = outputs.shape[:2]
+                results_ds = f.create_dataset(
+                    "results",
+                    shape=(n_vars, n_times, n_samples),
+                    dtype=outputs.dtype,
+                    chunks=(1, n_times, min(chunk_size, n_samples)),
+                )
+                results_ds.attrs["variables"] = variables
+
+            results_ds[:, :, start:end] = outputs
+
+            if extras_df is not None:
+                if extras_ds is None:
+                    extras_ds = f.create_dataset(
+                        "extras", shape=(n_samples, extras_df.shape[1]), dtype=float
+                    )
+                    extras_ds.attrs["columns"] = list(extras_df.columns)
+                extras_ds[start:end] = extras_df.loc[chunk_index].to_numpy()
+
+            start = end
+
+
+def _results_df_from_array(
+    data: np.ndarray, variables: list, time_index: pd.Index, sample_index: pd.Index
+) -> pd.DataFrame:
+    """Build a DataFrame in the layout returned by model_results_for_samples (time as index,
+    [variable, *sample levels] as columns) from an array of shape (variable, time, sample)
+    """
+    # Match model_results_for_samples, which orders samples within each variable
+    sample_index, order = sample_index.sort_values(return_indexer=True)
+    data = data[:, :, order]
+
+    levels = _get_index_levels(sample_index)
+    n_vars, n_times, n_samples = data.shape
+    columns = pd.MultiIndex.from_arrays(
+        [np.repeat(variables, n_samples)]
+        + [np.tile(sample_index.get_level_values(i), n_vars) for i in range(len(levels))],
+        names=["variable", *levels],
+    )
+    return pd.DataFrame(
+        data.transpose(1, 0, 2).reshape(n_times, n_vars * n_samples),
+        index=time_index,
+        columns=columns,
+    )
+
+
+def load_results_hdf5(in_file: Union[Path, str], as_array: bool = False) -> SampledResults:
+    """Load results written by model_results_to_hdf5, in the same layout as returned by
+    model_results_for_samples
+
+    Args:
+        in_file: Path to HDF5 file
+        as_array: Return results as a ResultsArray rather than a DataFrame
+
+    Returns:
+        SampledResults
+    """
+    import h5py
+
+    with h5py.File(in_file, "r") as f:
+        sample_index = _read_index_hdf5(f, "sample")
+        # Unnamed sample indices are labelled as per model_results_for_samples
+        sample_index = sample_index.set_names(list(_get_index_levels(sample_index)))
+        time_index = _read_index_hdf5(f, "time")
+        variables = list(f["results"].attrs["variables"])
+        data = f["results"][...]
+        if "extras" in f:
+            extras_df = pd.DataFrame(
+                f["extras"][...], index=sample_index, columns=list(f["extras"].attrs["columns"])
+            )
+        else:
+            extras_df = None
+
+    results = ResultsArray(data, variables, time_index, sample_index)
+
+    if extras_df is not None:
+        extras_df = extras_df.sort_index()
+
+    return SampledResults(results if as_array else results.to_dataframe(), extras_df)
+
+
 def quantiles_for_results(results_df: pd.DataFrame, quantiles: Tuple[float]) -> pd.DataFrame:
     """Summary
 
@@ -241,6 +974,55 @@ def quantiles_for_results(results_df: pd.DataFrame, quantiles: Tuple[float]) ->
     return udf
 
 
+def quantiles_for_samples(
+    samples: SampleContainer,
+    bcm: BayesianCompartmentalModel,
+    quantiles: Tuple[float],
+    chunk_size: int = 1000,
+    sketch_capacity: int = 1024,
+    num_workers: Optional[int] = None,
+    exec_mode: Optional[Union[str, WorkerPool]] = "thread",
+) -> pd.DataFrame:
+    """Compute quantiles of the model outputs for samples incrementally as they are run,
+    without materializing the full results; equivalent to calling quantiles_for_results on
+    the output of model_results_for_samples, but with memory O(time * outputs * sketch_capacity)
+    Results are exact for up to sketch_capacity samples, and approximate thereafter
+    (see estival.utils.quantiles.QuantileSketch)
+
+    Args:
+        samples: The samples to run
+        bcm: The BayesianCompartmentalModel to run
+        quantiles: Quantiles to compute [0.0,1.0]
+        chunk_size: Number of samples run (and held in memory) at a time
+        sketch_capacity: Number of values stored per level of the sketch; controls accuracy
+        num_workers: Number of parallel workers
+        exec_mode: Parallel execution mode (see map_parallel)
+
+    Returns:
+        pd.DataFrame: DataFrame with time as index and [variable, quantile] as columns
+    """
+    from estival.utils.quantiles import QuantileSketch
+
+    samples = bcm.sample.convert(samples)  # type: ignore
+
+    sketch = None
+    chunks = _iter_results_chunks(samples, bcm, chunk_size, False, num_workers, exec_mode)
+    for _, variables, outputs, _ in chunks:
+        if sketch is None:
+            sketch = QuantileSketch(outputs.shape[:2], sketch_capacity)
+        sketch.update(outputs)
+
+    # Shape (variable, time, quantile) -> (time, variable * quantile)
+    qvals = sketch.quantiles(quantiles)  # type: ignore
+    n_vars, n_times, n_q = qvals.shape
+    columns = pd.MultiIndex.from_product((variables, quantiles), names=["variable", "quantile"])
+    return pd.DataFrame(
+        qvals.transpose(1, 0, 2).reshape(n_times, n_vars * n_q),
+        index=bcm._ref_idx.rename("time"),
+        columns=columns,
+    )
+
+
 class IndexGetter:
     def __init__(self, func):
         self.func = func
@@ -256,7 +1038,7 @@ class SampleIterator:
     """
 
     def __init__(self, components: dict, index=None):
-        self.components = components
+        self.components = dict(components)
         self._clen = self._calc_component_length()
 
         if index is None:
@@ -265,6 +1047,52 @@ class SampleIterator:
         self.set_index(index)
 
         self._priors_stub = self._build_priorsize_table()
+        self.layout = get_prior_sizeinfo(self._priors_stub)
+        # Contiguous block of all components; only built when required (see _get_block)
+        self._block = None
+        self._packed = False
+        self._h5file = None
+        self._iter_batch_size = 1024
+
+    def _get_block(self) -> Optional[np.ndarray]:
+        """Return the contiguous (sample, parameter) block of all components, packing them
+        on first use (see _pack_components)
+        """
+        if not self._packed:
+            self._block = self._pack_components()
+            self._packed = True
+        return self._block
+
+    def _pack_components(self) -> Optional[np.ndarray]:
+        """Store all components in a single contiguous (sample, parameter) block, laid out as
+        per self.layout, and replace each component with a view of its columns
+        Components are left as-is if they are not all 1D/2D numeric arrays of the same dtype
+        This copies all components, so is only done on demand
+
+        Returns:
+            The block array, or None if the components could not be packed
+        """
+        arrays = {k: v for k, v in self.components.items() if isinstance(v, np.ndarray)}
+        if len(arrays) != len(self.components) or not arrays:
+            return None
+        dtypes = set([a.dtype for a in arrays.values()])
+        if len(dtypes) != 1 or not np.issubdtype(dtypes.pop(), np.number):
+            return None
+        if any([a.ndim not in (1, 2) for a in arrays.values()]):
+            return None
+
+        dtype = next(iter(arrays.values())).dtype
+        block = np.empty((self._clen, self.layout.tot_size), dtype=dtype)
+        start = 0
+        for size, (k, a) in zip(self.layout.sizes, arrays.items()):
+            if a.ndim == 2:
+                view = block[:, start : start + size]
+            else:
+                view = block[:, start]
+            view[...] = a
+            self.components[k] = view
+            start += size
+        return block
 
     def set_index(self, index: pd.Index):
         assert (
@@ -301,18 +1129,40 @@ class SampleIterator:
         return priors_stub
 
     def __iter__(self):
-        for i in range(self._clen):
-            out = {}
-            for k, v in self.components.items():
-                out[k] = v[i]
+        for _, out in self.iterrows():
             yield out
 
     def iterrows(self):
-        for i in range(self._clen):
-            out = {}
-            for k, v in self.components.items():
-                out[k] = v[i]
-            yield self.index[i], out
+        # Read in batches, so that lazily loaded (HDF5 backed) components are not read row by row
+        for batch_index, batch in self.iter_batches(self._iter_batch_size):
+            for i, idx in enumerate(batch_index):
+                out = {}
+                for k, v in batch.items():
+                    out[k] = v[i]
+                yield idx, out
+
+    def iter_batches(self, batch_size: int, as_array: bool = False):
+        """Iterate over contiguous batches of samples, without copying
+
+        Args:
+            batch_size: Maximum number of samples in each batch
+            as_array: Yield views of the contiguous (sample, parameter) block (laid out as
+                      per self.layout) rather than dicts of component views; the block is
+                      built (copying all components, once) on first use
+
+        Yields:
+            Tuples of (index, batch), where index is the pd.Index of samples in the batch
+        """
+        block = self._get_block() if as_array else None
+        if as_array and block is None:
+            raise TypeError("Components of this SampleIterator cannot be stored contiguously")
+
+        for start in range(0, self._clen, batch_size):
+            end = min(start + batch_size, self._clen)
+            if as_array:
+                yield self.index[start:end], block[start:end]  # type: ignore
+            else:
+                yield self.index[start:end], {k: v[start:end] for k, v in self.components.items()}
 
     def __getitembak__(self, idx):
         out = {}
@@ -327,9 +1177,11 @@ class SampleIterator:
             return SampleIterator(out, index=self.index[idx])
 
     def _subset(self, arr_idx):
+        if isinstance(arr_idx, pd.Series):
+            arr_idx = arr_idx.to_numpy()
         out = {}
         for k, v in self.components.items():
-            out[k] = v[arr_idx]
+            out[k] = _take_rows(v, arr_idx)
         result_index = self.index[arr_idx]
         if isinstance(result_index, pd.Index):
             return SampleIterator(out, index=self.index[arr_idx])
@@ -357,6 +1209,9 @@ class SampleIterator:
         return cls(components)
 
     def to_array(self):
+        # Copy from the contiguous block if it already exists, but don't build it just for this
+        if self._block is not None:
+            return self._block.astype(float)
         si = self
         sinfo = get_prior_sizeinfo(si._priors_stub)
         out = np.empty((si._clen, sinfo.tot_size))
@@ -366,40 +1221,188 @@ class SampleIterator:
         return out
 
     @classmethod
-    def read_hdf5(cls, file):
+    def read_hdf5(cls, file, lazy: bool = False):
+        """Read a SampleIterator written by to_hdf5
+
+        Args:
+            file: Path to the HDF5 file
+            lazy: Keep the file open and read only the rows requested by iteration, iloc and loc,
+                  rather than loading all data into memory.  Subsets returned by iloc and loc
+                  are loaded into memory.  Call close() when done
+
+        Returns:
+            The SampleIterator
+        """
         import h5py
 
         f = h5py.File(file, "r")
-        if f["index"].attrs["multi"] == True:
-            index = pd.MultiIndex.from_arrays(f["index"][...].T, names=f["index"].attrs["names"])
+        index = _read_index_hdf5(f, "index")
+        if lazy:
+            si = cls({k: f["variables"][k] for k in f.attrs["components"]}, index=index)
+            si._h5file = f
+            chunks = [f["variables"][k].chunks for k in si.components]
+            si._iter_batch_size = max([c[0] if c else si._iter_batch_size for c in chunks])
         else:
-            index = pd.Index(f["index"][...], name=f["index"].attrs["name"])
-        si = cls({k: f["variables"][k][...] for k in f.attrs["components"]}, index=index)
-        f.close()
+            si = cls({k: f["variables"][k][...] for k in f.attrs["components"]}, index=index)
+            f.close()
         return si
 
-    def to_hdf5(self, file):
+    def to_arrow(self):
+        """Convert to a pyarrow Table, with one column per index level and per component
+        Multidimensional components are stored as fixed size lists (of their flattened values)
+
+        Returns:
+            pyarrow.Table
+        """
+        import pyarrow as pa
+
+        levels = _get_index_levels(self.index)
+        arrays, shapes = {}, {}
+        for i, level in enumerate(levels):
+            if level in self.components:
+                raise KeyError("Index level name clashes with component", level)
+            arrays[level] = pa.array(self.index.get_level_values(i).to_numpy())
+        for k, v in self.components.items():
+            v = np.asarray(v)
+            shapes[k] = list(v.shape[1:])
+            if v.ndim == 1:
+                arrays[k] = pa.array(v)
+            else:
+                flat = v.reshape(len(v), -1)
+                arrays[k] = pa.FixedSizeListArray.from_arrays(pa.array(flat.ravel()), flat.shape[1])
+
+        metadata = {"levels": list(levels), "components": shapes}
+        table = pa.table(arrays)
+        return table.replace_schema_metadata({"estival": json.dumps(metadata)})
+
+    @classmethod
+    def from_arrow(cls, table):
+        """Build a SampleIterator from a pyarrow Table written by to_arrow
+
+        Args:
+            table: pyarrow.Table
+
+        Returns:
+            The SampleIterator
+        """
+        metadata = json.loads(table.schema.metadata[b"estival"])
+        levels = metadata["levels"]
+
+        level_values = [table.column(level).to_numpy() for level in levels]
+        if len(levels) == 1:
+            index = pd.Index(level_values[0], name=levels[0])
+        else:
+            index = pd.MultiIndex.from_arrays(level_values, names=levels)
+
+        components = {}
+        for k, shape in metadata["components"].items():
+            col = table.column(k).combine_chunks()
+            if shape:
+                components[k] = col.flatten().to_numpy().reshape(len(col), *shape)
+            else:
+                components[k] = col.to_numpy()
+        return cls(components, index=index)
+
+    @classmethod
+    def read_parquet(cls, file):
+        """Read a SampleIterator written by to_parquet
+
+        Args:
+            file: Path to the Parquet file
+
+        Returns:
+            The SampleIterator
+        """
+        import pyarrow.parquet as pq
+
+        return cls.from_arrow(pq.read_table(file))
+
+    def to_parquet(self, file):
+        """Write to a Parquet file (see to_arrow for layout), which can be read with read_parquet
+
+        Args:
+            file: Path to the Parquet file
+        """
+        import pyarrow.parquet as pq
+
+        pq.write_table(self.to_arrow(), file)
+
+    def close(self):
+        """Close the underlying file of a lazily loaded SampleIterator"""
+        if self._h5file is not None:
+            self._h5file.close()
+            self._h5file = None
+
+    def to_hdf5(self, file, compression: Optional[int] = None, chunk_rows: int = 1024):
+        """Write to an HDF5 file, which can be read with read_hdf5
+
+        Args:
+            file: Path to the HDF5 file
+            compression (optional): gzip compression level; note that compressed datasets
+                                    are slower to read in slices (see read_hdf5(lazy=True))
+            chunk_rows: Number of samples per HDF5 chunk
+        """
         import h5py
 
         si = self
         f = h5py.File(file, "w")
         for k, v in si.components.items():
-            f.create_dataset(f"variables/{k}", data=v, compression=1)
+            v = np.asarray(v)
+            chunks = (max(min(chunk_rows, len(v)), 1), *v.shape[1:])
+            f.create_dataset(f"variables/{k}", data=v, chunks=chunks, compression=compression)
 
-        if isinstance(si.index, pd.MultiIndex):
-            f.create_dataset("index", data=np.array(si.index.to_list()))
-            f["index"].attrs["names"] = si.index.names
-            f["index"].attrs["multi"] = True
-        else:
-            f.create_dataset("index", data=np.array(si.index.to_list()))
-            f["index"].attrs["name"] = si.index.name
-            f["index"].attrs["multi"] = False
+        _write_index_hdf5(f, "index", si.index)
 
         f.attrs["components"] = list(si.components)
 
         f.close()
 
 
+def _take_rows(v, arr_idx):
+    """Index the rows of an array-like v, supporting h5py datasets (which require increasing
+    indices, and read much faster from slices)
+    """
+    if isinstance(v, np.ndarray) or np.isscalar(arr_idx) or isinstance(arr_idx, slice):
+        return v[arr_idx]
+
+    uniq, inverse = np.unique(np.asarray(arr_idx), return_inverse=True)
+    if len(uniq) and uniq[-1] - uniq[0] + 1 == len(uniq):
+        rows = v[uniq[0] : uniq[-1] + 1]
+    else:
+        rows = v[uniq]
+    return rows[inverse]
+
+
+def _write_index_hdf5(f, name: str, index: pd.Index):
+    """Write a pandas Index (or MultiIndex) to dataset name of h5py File/Group f"""
+    # HDF5 attributes cannot store None; unnamed levels are stored as "" (and names are
+    # omitted for unnamed indices)
+    if isinstance(index, pd.MultiIndex):
+        f.create_dataset(name, data=np.array(index.to_list()))
+        f[name].attrs["names"] = ["" if n is None else n for n in index.names]
+        f[name].attrs["multi"] = True
+    elif isinstance(index, pd.DatetimeIndex):
+        f.create_dataset(name, data=index.asi8)
+        f[name].attrs["multi"] = False
+        f[name].attrs["datetime"] = True
+    else:
+        f.create_dataset(name, data=np.array(index.to_list()))
+        f[name].attrs["multi"] = False
+    if not isinstance(index, pd.MultiIndex) and index.name is not None:
+        f[name].attrs["name"] = index.name
+
+
+def _read_index_hdf5(f, name: str) -> pd.Index:
+    """Read a pandas Index written by _write_index_hdf5"""
+    if f[name].attrs["multi"] == True:
+        names = [n or None for n in f[name].attrs["names"]]
+        return pd.MultiIndex.from_arrays(f[name][...].T, names=names)
+    elif f[name].attrs.get("datetime", False):
+        return pd.DatetimeIndex(f[name][...], name=f[name].attrs.get("name"))
+    else:
+        return pd.Index(f[name][...], name=f[name].attrs.get("name"))
+
+
 def xarray_to_sampleiterator(in_data: xarray.Dataset):
     if list(in_data.dims)[0] == "sample":
         index = in_data.sample.to_index()
@@ -1,13 +1,15 @@
 from __future__ import annotations
 
-from typing import List, Tuple, Union
+from typing import Dict, List, Tuple, Union
 from abc import ABC, abstractmethod
 from copy import copy
 
 import pandas as pd
 import numpy as np
 
+import jax
 from jax import jit, scipy as jsp, numpy as jnp
+from scipy import special as sps
 
 from summer2.utils import Epoch
 
@@ -88,24 +90,45 @@ class TargetEvaluator(ABC):
         raise NotImplementedError()
 
 
-class NegativeBinomialEvaluator(TargetEvaluator):
-    def __init__(self, target: BaseTarget, model_times: pd.Index, epoch: Epoch):
+class StackableTargetEvaluator(TargetEvaluator):
+    """A TargetEvaluator whose loglikelihood is computed elementwise by ll_kernel, such that
+    evaluators of the same class can be fused into a single StackedTargetEvaluator
+    """
+
+    def __init__(self, target: BaseTarget, model_times: pd.Index, epoch: Epoch = None):
         super().__init__(target, model_times, epoch)
+        if len(self.index) == 0:
+            raise ValueError(f"Target {target.name} has no data within the model times")
+        self.kernel_data = self.get_kernel_data()
 
-    def evaluate(self, modelled: np.array, parameters: dict) -> float:
-        if isinstance(self.target.dispersion_param, BasePrior):
-            n = parameters[self.target.dispersion_param.name]
+    def get_kernel_data(self) -> dict:
+        """Return the (elementwise) arrays of observed data required by ll_kernel"""
+        return {"data": self.data}
+
+    def get_distri_param(self) -> DistriParam:
+        """Return the (scalar) distribution parameter passed to ll_kernel, if any"""
+        return None
+
+    def get_element_weights(self) -> np.ndarray:
+        """Return the weight of each data point's contribution to this target's loglikelihood,
+        equivalent to the reduction used by evaluate
+        """
+        if self.time_weights is not None:
+            return self.time_weights * self.target.weight
         else:
-            n = self.target.dispersion_param
+            return np.full(len(self.index), self.target.weight / len(self.index))
 
-        # We use the parameterisation based on mean and variance and assume define var=mean**delta
-        mu = modelled[self.index]
-        # work out parameter p to match the distribution mean with the model output
-        p = mu / (mu + n)
-        # Attempt to minimize -inf showing up
-        p = jnp.where(p < 1e-16, 1e-16, p)
-        # ll = np.sum(stats.nbinom.logpmf(self.data, n, 1.0 - p) * self.time_weights)
-        ll = jsp.stats.nbinom.logpmf(self.data, n, 1.0 - p)
+    @staticmethod
+    @abstractmethod
+    def ll_kernel(kernel_data: dict, modelled, distri_param):
+        raise NotImplementedError()
+
+    def evaluate(self, modelled: np.array, parameters: dict) -> float:
+        distri_param = self.get_distri_param()
+        if isinstance(distri_param, BasePrior):
+            distri_param = parameters[distri_param.name]
+
+        ll = self.ll_kernel(self.kernel_data, modelled[self.index], distri_param)
 
         if self.time_weights is not None:
             ll = ll * self.time_weights
@@ -114,6 +137,124 @@ class NegativeBinomialEvaluator(TargetEvaluator):
             return jnp.mean(ll) * self.target.weight
 
 
+class StackedTargetEvaluator:
+    """Evaluates a group of StackableTargetEvaluators of the same class as a single
+    vectorized operation over their concatenated data, indices and weights, so that the
+    size of the traced graph does not grow with the number of targets
+    """
+
+    def __init__(self, names: List[str], evaluators: List[StackableTargetEvaluator]):
+        self.names = names
+        self._kernel = type(evaluators[0]).ll_kernel
+
+        self.model_keys = list(dict.fromkeys([ev.target.model_key for ev in evaluators]))
+        key_pos = {k: i for i, k in enumerate(self.model_keys)}
+
+        lengths = [len(ev.index) for ev in evaluators]
+        self.segments = np.repeat(np.arange(len(evaluators)), lengths)
+        self.time_index = np.concatenate([ev.index for ev in evaluators]).astype(int)
+        self.key_index = np.repeat([key_pos[ev.target.model_key] for ev in evaluators], lengths)
+        self.weights = np.concatenate([ev.get_element_weights() for ev in evaluators])
+        self.kernel_data = {
+            k: np.concatenate([ev.kernel_data[k] for ev in evaluators])
+            for k in evaluators[0].kernel_data
+        }
+
+        # Distribution parameters are either fixed per target, or looked up from the
+        # parameters; store the fixed values, and the positions to fill at evaluation time
+        distri_params = [ev.get_distri_param() for ev in evaluators]
+        self._has_distri_param = distri_params[0] is not None
+        self._dp_values = np.array(
+            [0.0 if isinstance(dp, BasePrior) or dp is None else dp for dp in distri_params]
+        )
+        prior_names = [dp.name if isinstance(dp, BasePrior) else None for dp in distri_params]
+        self._dp_names = list(dict.fromkeys([n for n in prior_names if n is not None]))
+        self._dp_targets = np.array([i for i, n in enumerate(prior_names) if n is not None])
+        self._dp_name_idx = np.array(
+            [self._dp_names.index(n) for n in prior_names if n is not None], dtype=int
+        )
+
+    def _get_distri_params(self, parameters: dict):
+        if not self._has_distri_param:
+            return None
+        if self._dp_names:
+            prior_values = jnp.stack([parameters[n] for n in self._dp_names])
+            target_values = (
+                jnp.asarray(self._dp_values)
+                .at[self._dp_targets]
+                .set(prior_values[self._dp_name_idx])
+            )
+        else:
+            target_values = self._dp_values
+        return target_values[self.segments]
+
+    def evaluate_components(self, modelled_do: dict, parameters: dict):
+        """Return the (weighted) loglikelihood of each target in the group
+
+        Args:
+            modelled_do: Dict of derived outputs, as returned by the model runner
+            parameters: Dict of parameter values
+
+        Returns:
+            Array of loglikelihood values, in the same order as self.names
+        """
+        stacked_do = jnp.stack([modelled_do[k] for k in self.model_keys], axis=-1)
+        modelled = stacked_do[self.time_index, self.key_index]
+        ll = self._kernel(self.kernel_data, modelled, self._get_distri_params(parameters))
+        return jax.ops.segment_sum(ll * self.weights, self.segments, num_segments=len(self.names))
+
+
+def group_evaluators(
+    evaluators: Dict[str, TargetEvaluator],
+) -> Tuple[List[StackedTargetEvaluator], Dict[str, TargetEvaluator]]:
+    """Group all StackableTargetEvaluators by class (distribution family)
+
+    Args:
+        evaluators: Dict of evaluators, keyed by target name
+
+    Returns:
+        Tuple of (StackedTargetEvaluators, dict of remaining unstackable evaluators)
+    """
+    groups = {}
+    unstacked = {}
+    for name, ev in evaluators.items():
+        if isinstance(ev, StackableTargetEvaluator):
+            groups.setdefault(type(ev), {})[name] = ev
+        else:
+            unstacked[name] = ev
+
+    stacked = [StackedTargetEvaluator(list(g), list(g.values())) for g in groups.values()]
+    return stacked, unstacked
+
+
+class NegativeBinomialEvaluator(StackableTargetEvaluator):
+    def __init__(self, target: BaseTarget, model_times: pd.Index, epoch: Epoch):
+        super().__init__(target, model_times, epoch)
+
+    def get_kernel_data(self) -> dict:
+        data = self.data.astype(float)
+        # log(k!) depends only on the observed data, so is computed once here
+        return {"data": data, "lgamma_data1": sps.gammaln(data + 1.0)}
+
+    def get_distri_param(self) -> DistriParam:
+        return self.target.dispersion_param
+
+    @staticmethod
+    def ll_kernel(kernel_data: dict, modelled, distri_param):
+        n = distri_param
+        k = kernel_data["data"]
+
+        # We use the parameterisation based on mean and variance and assume define var=mean**delta
+        mu = modelled
+        # work out parameter p to match the distribution mean with the model output
+        p = mu / (mu + n)
+        # Attempt to minimize -inf showing up
+        p = jnp.where(p < 1e-16, 1e-16, p)
+        # Equivalent to jsp.stats.nbinom.logpmf(k, n, 1.0 - p)
+        lcoeff = jsp.special.gammaln(k + n) - jsp.special.gammaln(n) - kernel_data["lgamma_data1"]
+        return lcoeff + n * jnp.log1p(-p) + jsp.special.xlogy(k, p)
+
+
 class NegativeBinomialTarget(BaseTarget):
     """
     A calibration target sampled from a negative binomial distribution
@@ -164,29 +305,24 @@ class BinomialTarget(BaseTarget):
         return BinomialEvaluator(self, model_times, epoch)
 
 
-class BinomialEvaluator(TargetEvaluator):
+class BinomialEvaluator(StackableTargetEvaluator):
     def __init__(self, target: BaseTarget, model_times: pd.Index, epoch: Epoch):
         super().__init__(target, model_times, epoch)
-        # Enforce this here so TFP-jax picks the right output types
-        self.sample_sizes = self.sample_sizes.astype(float)
-
-    def evaluate(self, modelled: np.array, parameters: dict) -> float:
-        from tensorflow_probability.substrates import jax as tfp
 
+    def get_kernel_data(self) -> dict:
+        self.sample_sizes = self.sample_sizes.astype(float)
+        n = self.sample_sizes
+        k = self.data * n
+        # The binomial coefficient depends only on the observed data, so is computed once here
+        lchoose = sps.gammaln(n + 1.0) - sps.gammaln(k + 1.0) - sps.gammaln(n - k + 1.0)
+        return {"n": n, "k": k, "lchoose": lchoose}
+
+    @staticmethod
+    def ll_kernel(kernel_data: dict, modelled, distri_param):
         # use a binomial (n, p) where n is the sample size observed in the data and p the modelled proportion
         # We then evaluate the binomial density for k, which represents the numerator observed in the data
-        n = self.target.sample_sizes
-        p = modelled[self.index]
-        k = self.target.data * n
-
-        bdist = tfp.distributions.Binomial(total_count=n, probs=p)
-        ll = bdist.log_prob(k)
-
-        if self.time_weights is not None:
-            ll = ll * self.time_weights
-            return jnp.sum(ll) * self.target.weight
-        else:
-            return jnp.mean(ll) * self.target.weight
+        n, k, p = kernel_data["n"], kernel_data["k"], modelled
+        return kernel_data["lchoose"] + jsp.special.xlogy(k, p) + jsp.special.xlog1py(n - k, -p)
 
 
 class TruncatedNormalTarget(BaseTarget):
@@ -218,23 +354,29 @@ class TruncatedNormalTarget(BaseTarget):
         return TruncatedNormalTargetEvaluator(self, model_times, epoch)
 
 
-class TruncatedNormalTargetEvaluator(TargetEvaluator):
+class TruncatedNormalTargetEvaluator(StackableTargetEvaluator):
     def __init__(self, target: TruncatedNormalTarget, model_times: pd.Index, epoch: Epoch):
         super().__init__(target, model_times, epoch)
 
-    def evaluate(self, modelled: np.array, parameters: dict) -> float:
-        if isinstance(self.target.stdev, BasePrior):
-            sd = parameters[self.target.stdev.name]
-        else:
-            sd = self.target.stdev
+    def get_kernel_data(self) -> dict:
+        return {
+            "data": self.data,
+            "low": np.full(len(self.data), self.target.trunc_range[0], dtype=float),
+            "high": np.full(len(self.data), self.target.trunc_range[1], dtype=float),
+        }
+
+    def get_distri_param(self) -> DistriParam:
+        return self.target.stdev
 
+    @staticmethod
+    def ll_kernel(kernel_data: dict, modelled, distri_param):
         from tensorflow_probability.substrates.jax import distributions as tfpd
 
         tdist = tfpd.TruncatedNormal(
-            loc=modelled[self.index],
-            scale=sd,
-            low=self.target.trunc_range[0],
-            high=self.target.trunc_range[1],
+            loc=modelled,
+            scale=distri_param,
+            low=kernel_data["low"],
+            high=kernel_data["high"],
         )
 
         # distri_params = {
@@ -245,13 +387,7 @@ class TruncatedNormalTargetEvaluator(TargetEvaluator):
 
         # ll = jsp.stats.truncnorm.logpdf(modelled[self.index], loc=self.data, **distri_params)
 
-        ll = tdist.log_prob(self.data)
-
-        if self.time_weights is not None:
-            ll = ll * self.time_weights
-            return jnp.sum(ll) * self.target.weight
-        else:
-            return jnp.mean(ll) * self.target.weight
+        return tdist.log_prob(kernel_data["data"])
 
 
 class NormalTarget(BaseTarget):
@@ -281,23 +417,16 @@ class NormalTarget(BaseTarget):
         return NormalTargetEvaluator(self, model_times, epoch)
 
 
-class NormalTargetEvaluator(TargetEvaluator):
+class NormalTargetEvaluator(StackableTargetEvaluator):
     def __init__(self, target: BaseTarget, model_times: pd.Index, epoch: Epoch):
         super().__init__(target, model_times, epoch)
 
-    def evaluate(self, modelled: np.array, parameters: dict) -> float:
-        if isinstance(self.target.stdev, BasePrior):
-            sd = parameters[self.target.stdev.name]
-        else:
-            sd = self.target.stdev
-
-        ll = jsp.stats.norm.logpdf(self.data, loc=modelled[self.index], scale=sd)
+    def get_distri_param(self) -> DistriParam:
+        return self.target.stdev
 
-        if self.time_weights is not None:
-            ll = ll * self.time_weights
-            return jnp.sum(ll) * self.target.weight
-        else:
-            return jnp.mean(ll) * self.target.weight
+    @staticmethod
+    def ll_kernel(kernel_data: dict, modelled, distri_param):
+        return jsp.stats.norm.logpdf(kernel_data["data"], loc=modelled, scale=distri_param)
 
 
 class BetaTarget(BaseTarget):
@@ -360,29 +489,23 @@ class BetaTarget(BaseTarget):
         return cls(name, data, a, b, weight, time_weights, model_key)
 
 
-class BetaEvaluator(TargetEvaluator):
+class BetaEvaluator(StackableTargetEvaluator):
     def __init__(self, target: BaseTarget, model_times: pd.Index, epoch: Epoch):
         super().__init__(target, model_times, epoch)
 
-    def evaluate(self, modelled: np.array, parameters: dict) -> float:
-        from tensorflow_probability.substrates import jax as tfp
-
-        # use a binomial (n, p) where n is the sample size observed in the data and p the modelled proportion
-        # We then evaluate the binomial density for k, which represents the numerator observed in the data
-        a = self.target.a
-        b = self.target.b
-
-        m = modelled[self.index]
-        # k = self.target.data * n
-
-        bdist = tfp.distributions.Beta(a, b)
-        ll = bdist.log_prob(m)
-
-        if self.time_weights is not None:
-            ll = ll * self.time_weights
-            return jnp.sum(ll) * self.target.weight
-        else:
-            return jnp.mean(ll) * self.target.weight
+    def get_kernel_data(self) -> dict:
+        a = self.a.astype(float)
+        b = self.b.astype(float)
+        # The normalising constant depends only on the target data, so is computed once here
+        return {"a": a, "b": b, "lbeta": sps.betaln(a, b)}
+
+    @staticmethod
+    def ll_kernel(kernel_data: dict, modelled, distri_param):
+        # Evaluate the density of the modelled proportion under a beta distribution
+        # whose parameters are determined by the target data
+        a, b, m = kernel_data["a"], kernel_data["b"], modelled
+        ll = jsp.special.xlogy(a - 1.0, m) + jsp.special.xlog1py(b - 1.0, -m)
+        return ll - kernel_data["lbeta"]
 
 
 class CustomTargetEvaluator(TargetEvaluator):
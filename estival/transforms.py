@@ -0,0 +1,121 @@
+from typing import Tuple
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from jax import numpy as jnp
+from jax import nn as jnn
+
+
+class Transform(ABC):
+    """A bijection between the (constrained) support of a prior and the real line"""
+
+    @abstractmethod
+    def forward(self, x):
+        """Map constrained values x to unconstrained values z"""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def inverse(self, z):
+        """Map unconstrained values z to constrained values x"""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def inverse_log_det_jacobian(self, z):
+        """Return log|dx/dz| at z, the correction required for densities expressed over z"""
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}"
+
+
+class IdentityTransform(Transform):
+    """Transform for priors with support over the whole real line"""
+
+    def forward(self, x):
+        return jnp.asarray(x)
+
+    def inverse(self, z):
+        return jnp.asarray(z)
+
+    def inverse_log_det_jacobian(self, z):
+        return jnp.zeros_like(z)
+
+
+class LowerBoundTransform(Transform):
+    """Log transform for priors with support (lower, inf)"""
+
+    def __init__(self, lower: float):
+        self.lower = lower
+
+    def forward(self, x):
+        return jnp.log(x - self.lower)
+
+    def inverse(self, z):
+        return self.lower + jnp.exp(z)
+
+    def inverse_log_det_jacobian(self, z):
+        return jnp.asarray(z)
+
+    def __repr__(self):
+        return f"{super().__repr__()} {{lower: {self.lower}}}"
+
+
+class UpperBoundTransform(Transform):
+    """Log transform for priors with support (-inf, upper)"""
+
+    def __init__(self, upper: float):
+        self.upper = upper
+
+    def forward(self, x):
+        return jnp.log(self.upper - x)
+
+    def inverse(self, z):
+        return self.upper - jnp.exp(z)
+
+    def inverse_log_det_jacobian(self, z):
+        return jnp.asarray(z)
+
+    def __repr__(self):
+        return f"{super().__repr__()} {{upper: {self.upper}}}"
+
+
+class IntervalTransform(Transform):
+    """Logit transform for priors with support (lower, upper)"""
+
+    def __init__(self, lower: float, upper: float):
+        self.lower = lower
+        self.upper = upper
+
+    def forward(self, x):
+        u = (x - self.lower) / (self.upper - self.lower)
+        return jnp.log(u) - jnp.log1p(-u)
+
+    def inverse(self, z):
+        return self.lower + (self.upper - self.lower) * jnn.sigmoid(z)
+
+    def inverse_log_det_jacobian(self, z):
+        return jnp.log(self.upper - self.lower) + jnn.log_sigmoid(z) + jnn.log_sigmoid(-z)
+
+    def __repr__(self):
+        return f"{super().__repr__()} {{bounds: {(self.lower, self.upper)}}}"
+
+
+def get_support_transform(bounds: Tuple[float, float]) -> Transform:
+    """Return the Transform mapping the real line to a (possibly infinite) interval
+
+    Args:
+        bounds: Tuple of lower, upper bounds of the support
+
+    Returns:
+        The appropriate Transform
+    """
+    lower, upper = float(bounds[0]), float(bounds[1])
+    if np.isinf(lower) and np.isinf(upper):
+        return IdentityTransform()
+    elif np.isinf(upper):
+        return LowerBoundTransform(lower)
+    elif np.isinf(lower):
+        return UpperBoundTransform(upper)
+    else:
+        return IntervalTransform(lower, upper)
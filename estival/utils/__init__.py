@@ -1 +1,5 @@
 from . import parallel
+from . import compile_cache
+from . import memo
+from . import quantiles
+from . import aio
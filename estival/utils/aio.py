@@ -0,0 +1,109 @@
+"""asyncio interfaces to model evaluation, for driving estival from an event loop
+without blocking it
+
+Evaluations are run on an executor (the event loop's default ThreadPoolExecutor unless
+one is supplied), with the number in flight bounded by a semaphore
+"""
+
+from typing import Callable, Iterable, Optional
+from concurrent.futures import Executor
+from functools import partial
+import asyncio
+import multiprocessing as mp
+
+from estival.model import BayesianCompartmentalModel, ResultsData
+
+
+class AsyncBCM:
+    """Wraps a BayesianCompartmentalModel, providing awaitable versions of its
+    evaluation methods
+
+    For example:
+
+    abcm = AsyncBCM(bcm, max_concurrency=4)
+    ll = await abcm.loglikelihood(**parameters)
+    """
+
+    def __init__(
+        self,
+        bcm: BayesianCompartmentalModel,
+        executor: Optional[Executor] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        """
+        Args:
+            bcm: The BayesianCompartmentalModel to evaluate
+            executor (optional): Executor on which to run evaluations; defaults to the
+                                 event loop's default executor
+            max_concurrency (optional): Maximum number of evaluations in flight at once;
+                                        further calls wait until a slot is free.
+                                        Defaults to cpu_count
+        """
+        self.bcm = bcm
+        self.executor = executor
+        self.max_concurrency = max_concurrency or int(mp.cpu_count())
+        self._semaphore = None
+
+    async def _call(self, func: Callable, *args, **kwargs):
+        # Created lazily, so that it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def loglikelihood(self, **parameters) -> float:
+        """Awaitable version of BayesianCompartmentalModel.loglikelihood"""
+        return float(await self._call(self.bcm.loglikelihood, **parameters))
+
+    async def logprior(self, **parameters) -> float:
+        """Awaitable version of BayesianCompartmentalModel.logprior"""
+        return float(await self._call(self.bcm.logprior, **parameters))
+
+    async def logposterior(self, **parameters) -> float:
+        """Awaitable version of BayesianCompartmentalModel.logposterior"""
+        return float(await self._call(self.bcm.logposterior, **parameters))
+
+    async def run(self, parameters: dict, include_extras=True, include_outputs=True) -> ResultsData:
+        """Awaitable version of BayesianCompartmentalModel.run"""
+        return await self._call(
+            self.bcm.run,
+            parameters,
+            include_extras=include_extras,
+            include_outputs=include_outputs,
+        )
+
+
+async def map_parallel_async(
+    run_func: Callable,
+    input_iterator: Iterable,
+    executor: Optional[Executor] = None,
+    max_concurrency: Optional[int] = None,
+) -> list:
+    """Awaitable equivalent of map_parallel; maps the values of input_iterator over run_func
+    on an executor, without blocking the event loop
+
+    Inputs are consumed lazily, with at most max_concurrency submitted at any one time,
+    so that large (or generated) inputs do not flood the executor
+
+    Args:
+        run_func: The function to call over the mapped inputs
+        input_iterator: An iterable containing the values to map
+        executor (optional): Executor on which to run; defaults to the event loop's default
+                             executor.  Process executors require run_func to be picklable
+        max_concurrency (optional): Maximum number of inputs in flight; defaults to cpu_count
+
+    Returns:
+        A list of values returned by run_func, in input order
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency or int(mp.cpu_count()))
+
+    futures = []
+    for item in input_iterator:
+        await semaphore.acquire()
+        fut = loop.run_in_executor(executor, run_func, item)
+        fut.add_done_callback(lambda _: semaphore.release())
+        futures.append(fut)
+
+    return list(await asyncio.gather(*futures))
@@ -0,0 +1,32 @@
+from typing import Union
+from pathlib import Path
+
+import jax
+
+
+def enable_compilation_cache(cache_dir: Union[str, Path], min_compile_time_secs: float = 1.0):
+    """Enable jax's persistent compilation cache, such that compiled executables are written
+    to cache_dir and reloaded (rather than recompiled) by any later process that compiles
+    the same function.  Entries are keyed by a hash of the lowered computation, so a
+    BayesianCompartmentalModel's likelihood is shared between processes exactly when its
+    model structure, targets, priors and fixed parameters are the same
+
+    Note that this updates jax's (process-wide) configuration, and so applies to every
+    function jitted in this process, not just those of estival; call it once, at start-up
+    (and in each worker process)
+
+    Args:
+        cache_dir: Directory in which to store compiled executables (created if missing)
+        min_compile_time_secs: Only persist functions whose compilation took longer than this
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        jax.config.update("jax_compilation_cache_dir", str(cache_dir))
+        jax.config.update("jax_persistent_cache_min_compile_time_secs", min_compile_time_secs)
+    except AttributeError:
+        # Older versions of jax only expose the cache via the experimental API
+        from jax.experimental.compilation_cache import compilation_cache as cc
+
+        cc.initialize_cache(str(cache_dir))
@@ -0,0 +1,271 @@
+"""A simple distributed backend for map_parallel, built on multiprocessing.managers
+
+A DistributedPool serves a task queue, a result queue and a payload dict over TCP;
+workers (started on any machine via run_worker, or from the command line) connect to it,
+load the shared objects (typically a BayesianCompartmentalModel) once, and then stream
+tasks and results
+
+On the head node:
+
+with DistributedPool(address=("0.0.0.0", 5555), authkey=b"secret", shared=[bcm]) as pool:
+    extras = likelihood_extras_for_samples(samples, bcm, exec_mode=pool)
+
+On each worker node:
+
+python -m estival.utils.distributed headnode:5555 --authkey secret
+"""
+
+from typing import Callable, Iterable, Optional, Sequence, Tuple
+
+import hashlib
+import io
+import multiprocessing as mp
+import os
+import queue
+from multiprocessing.managers import BaseManager, DictProxy
+
+import cloudpickle
+
+from .parallel import _dumps_shared, _SharedUnpickler
+
+# Server-side state; these only exist in the manager's server process
+_task_queue = queue.Queue()
+_result_queue = queue.Queue()
+_payload = {}
+
+
+def _get_task_queue():
+    return _task_queue
+
+
+def _get_result_queue():
+    return _result_queue
+
+
+def _get_payload():
+    return _payload
+
+
+class _ServerManager(BaseManager):
+    pass
+
+
+_ServerManager.register("get_task_queue", callable=_get_task_queue)
+_ServerManager.register("get_result_queue", callable=_get_result_queue)
+_ServerManager.register("get_payload", callable=_get_payload, proxytype=DictProxy)
+
+
+class _ClientManager(BaseManager):
+    pass
+
+
+_ClientManager.register("get_task_queue")
+_ClientManager.register("get_result_queue")
+_ClientManager.register("get_payload", proxytype=DictProxy)
+
+
+def _dumps_result(res: tuple) -> bytes:
+    """Pickle a (success, value) result; results and exceptions which cannot be pickled
+    (or unpickled) are replaced with a RuntimeError, so that the pool is always notified
+    """
+    success, value = res
+    try:
+        res_cpkl = cloudpickle.dumps(res)
+        if not success:
+            cloudpickle.loads(res_cpkl)
+        return res_cpkl
+    except Exception as e:
+        if success:
+            msg = f"Could not pickle result: {e!r}"
+        else:
+            msg = repr(value)
+        return cloudpickle.dumps((False, RuntimeError(msg)))
+
+
+def run_worker(address: Tuple[str, int], authkey: bytes):
+    """Connect to a DistributedPool and evaluate its tasks until the pool is closed
+    (or the connection is lost)
+
+    Args:
+        address: (host, port) of the DistributedPool
+        authkey: Authentication key of the DistributedPool
+    """
+    manager = _ClientManager(address=tuple(address), authkey=authkey)
+    manager.connect()
+    task_queue = manager.get_task_queue()  # type: ignore
+    result_queue = manager.get_result_queue()  # type: ignore
+    payload = manager.get_payload()  # type: ignore
+
+    shared = cloudpickle.loads(payload["shared"])
+    funcs = {}
+
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                # Leave the sentinel in place for any other workers
+                task_queue.put(None)
+                break
+
+            map_id, task_id, func_key, args_cpkl = task
+            try:
+                if func_key not in funcs:
+                    func_pkl = payload["func_" + func_key]
+                    funcs = {func_key: _SharedUnpickler(io.BytesIO(func_pkl), shared).load()}
+                res = (True, funcs[func_key](cloudpickle.loads(args_cpkl)))
+            except Exception as e:
+                res = (False, e)
+            result_queue.put((map_id, task_id, _dumps_result(res)))
+    except (EOFError, ConnectionError):
+        # The pool has shut down
+        pass
+
+
+class DistributedPool:
+    """A pool of (possibly remote) workers, which can be used in place of a WorkerPool
+    as the mode argument of map_parallel
+
+    Objects supplied as shared are sent to each worker once; as with WorkerPool, any
+    references held to them by mapped functions are resolved to the workers' existing copies
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int] = ("127.0.0.1", 0),
+        authkey: Optional[bytes] = None,
+        shared: Sequence = (),
+        n_workers: Optional[int] = None,
+        n_local_workers: int = 0,
+        poll_interval: float = 1.0,
+    ):
+        """
+        Args:
+            address: (host, port) to serve on; a port of 0 selects a free port
+            authkey (optional): Key which workers must supply to connect; randomly generated
+                                if not supplied (see the authkey attribute)
+            shared: Objects to send to each worker once, when it connects
+            n_workers (optional): Expected total number of workers, used to choose chunksizes
+                                  in map_parallel; defaults to n_local_workers or cpu_count
+            n_local_workers: Number of worker processes to start on this machine
+            poll_interval: Seconds between checks that local workers are still alive
+        """
+        if authkey is None:
+            authkey = os.urandom(16)
+
+        self.authkey = authkey
+        self.shared = list(shared)
+        self.n_workers = n_workers or n_local_workers or int(mp.cpu_count())
+        self.poll_interval = poll_interval
+
+        # Processes are spawned (rather than forked), since forking a process in which jax
+        # is initialized can deadlock
+        ctx = mp.get_context("spawn")
+        self._manager = _ServerManager(address=address, authkey=authkey, ctx=ctx)
+        self._manager.start()
+        self.address = self._manager.address
+
+        self._task_queue = self._manager.get_task_queue()  # type: ignore
+        self._result_queue = self._manager.get_result_queue()  # type: ignore
+        self._payload = self._manager.get_payload()  # type: ignore
+        self._payload["shared"] = cloudpickle.dumps(self.shared)
+
+        self.run_func = None
+        self._func_key = None
+        self._map_id = 0
+
+        self._local_workers = []
+        for _ in range(n_local_workers):
+            p = ctx.Process(target=run_worker, args=(self.address, self.authkey), daemon=True)
+            p.start()
+            self._local_workers.append(p)
+
+    def set_function(self, run_func: Callable):
+        """Set the function to be called by map
+
+        Args:
+            run_func: The function to call over the mapped inputs
+        """
+        if run_func is self.run_func:
+            return
+        self.run_func = run_func
+        func_pkl = _dumps_shared(run_func, self.shared)
+        self._func_key = hashlib.sha1(func_pkl).hexdigest()
+        if ("func_" + self._func_key) not in self._payload:
+            self._payload["func_" + self._func_key] = func_pkl
+
+    def map(self, input_iterator: Iterable) -> list:
+        """Map the values of input_iterator over the current function
+
+        Args:
+            input_iterator: An iterable containing the values to map
+
+        Returns:
+            A list of values returned by the function, in input order
+        """
+        if self.run_func is None:
+            raise ValueError("No function set; call set_function first")
+
+        self._map_id += 1
+        n_tasks = 0
+        for task_id, args in enumerate(input_iterator):
+            args_cpkl = cloudpickle.dumps(args)
+            self._task_queue.put((self._map_id, task_id, self._func_key, args_cpkl))
+            n_tasks += 1
+
+        results = {}
+        while len(results) < n_tasks:
+            try:
+                map_id, task_id, res_cpkl = self._result_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                if self._local_workers and not any([p.is_alive() for p in self._local_workers]):
+                    raise RuntimeError("All local workers have exited")
+                continue
+            if map_id != self._map_id:
+                # Stale result from a previously failed map
+                continue
+            success, value = cloudpickle.loads(res_cpkl)
+            if not success:
+                raise value
+            results[task_id] = value
+
+        return [results[i] for i in range(n_tasks)]
+
+    def close(self):
+        """Signal workers to exit, and shut down the server"""
+        self._task_queue.put(None)
+        for p in self._local_workers:
+            p.join()
+        self._local_workers = []
+        self._manager.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _parse_address(address: str) -> Tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run an estival distributed worker")
+    parser.add_argument("address", help="host:port of the DistributedPool")
+    parser.add_argument("--authkey", required=True, help="Authentication key of the pool")
+    parser.add_argument("--n-workers", type=int, default=1, help="Worker processes to run")
+    args = parser.parse_args()
+
+    address = _parse_address(args.address)
+    authkey = args.authkey.encode()
+    ctx = mp.get_context("spawn")
+    workers = [
+        ctx.Process(target=run_worker, args=(address, authkey)) for _ in range(args.n_workers)
+    ]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
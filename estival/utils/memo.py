@@ -0,0 +1,109 @@
+from typing import Any, Optional, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+import hashlib
+
+import numpy as np
+
+
+@dataclass
+class CacheInfo:
+    hits: int
+    misses: int
+    entries: int
+    nbytes: int
+    max_entries: int
+    max_bytes: Optional[int]
+
+
+def hash_parameters(parameters: dict, *extra) -> str:
+    """Return a digest of a dict of parameter values (scalars or arrays), suitable for use
+    as a cache key; any extra (hashable, repr-stable) values are included in the key
+
+    Args:
+        parameters: Dict of parameter key/values
+
+    Returns:
+        Hex digest string
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(repr(extra).encode())
+    for k in sorted(parameters):
+        v = np.ascontiguousarray(parameters[k])
+        h.update(k.encode())
+        h.update(str((v.dtype.str, v.shape)).encode())
+        h.update(v.tobytes())
+    return h.hexdigest()
+
+
+class LRUCache:
+    """A thread-safe least-recently-used cache, bounded by both the number of entries
+    and (optionally) their estimated total size in bytes
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self.clear()
+
+    def clear(self):
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Look up key, returning a tuple of (found, value)"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key][0]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: str, value: Any, nbytes: int = 0):
+        """Store value under key, evicting the least recently used entries as required
+
+        Args:
+            key: Cache key (see hash_parameters)
+            value: The value to store
+            nbytes: Estimated size of value in bytes, used for the max_bytes limit
+        """
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self.nbytes > self.max_bytes
+            ):
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_bytes
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(
+            self.hits,
+            self.misses,
+            len(self._entries),
+            self.nbytes,
+            self.max_entries,
+            self.max_bytes,
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Locks cannot be pickled; recreate on unpickling (ie when sent to a worker process)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
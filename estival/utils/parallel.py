@@ -1,6 +1,16 @@
-from typing import Callable, Iterable, Optional, Type
+from typing import Callable, Iterable, Optional, Sequence, Type, Union
 
 import multiprocessing as mp
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+import hashlib
+import io
+import math
+import os
+import pickle
+import shutil
+import tempfile
 
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
@@ -34,43 +44,402 @@ def generic_cpkl_worker(*args):
     return run_func(*args)
 
 
+class _SharedPickler(cloudpickle.CloudPickler):
+    """A CloudPickler that replaces references to shared objects with persistent ids,
+    such that they are not serialized (see WorkerPool)
+    """
+
+    def __init__(self, file, shared_ids: dict):
+        super().__init__(file)
+        self._shared_ids = shared_ids
+
+    def persistent_id(self, obj):
+        return self._shared_ids.get(id(obj))
+
+
+class _SharedUnpickler(pickle.Unpickler):
+    def __init__(self, file, shared: Sequence):
+        super().__init__(file)
+        self._shared = shared
+
+    def persistent_load(self, pid):
+        return self._shared[pid]
+
+
+def _dumps_shared(obj, shared: Sequence) -> bytes:
+    buf = io.BytesIO()
+    _SharedPickler(buf, {id(v): i for i, v in enumerate(shared)}).dump(obj)
+    return buf.getvalue()
+
+
+def _pool_init(
+    shared_cpkl: bytes,
+    func_dir: str,
+    n_threads: int = 1,
+    cpu_sets: Optional[list] = None,
+    counter=None,
+):
+    """Initialize a WorkerPool process with its shared objects
+
+    Args:
+        shared_cpkl: The cloudpickle.dumps output of the shared objects
+        func_dir: Directory from which pickled functions are loaded
+        n_threads: Number of threads to run in this process ('hybrid' mode)
+        cpu_sets (optional): Sets of cpus, one of which is assigned to each process in turn
+        counter (optional): Shared mp.Value, used to assign cpu_sets
+    """
+    global pool_shared, pool_func_dir, pool_funcs, pool_thread_executor
+
+    if cpu_sets and hasattr(os, "sched_setaffinity"):
+        with counter.get_lock():  # type: ignore
+            worker_idx = counter.value  # type: ignore
+            counter.value += 1  # type: ignore
+        os.sched_setaffinity(0, cpu_sets[worker_idx % len(cpu_sets)])
+
+    pool_shared = cloudpickle.loads(shared_cpkl)
+    pool_func_dir = func_dir
+    pool_funcs = {}
+    pool_thread_executor = ThreadPoolExecutor(n_threads) if n_threads > 1 else None
+
+
+def _load_pool_func(func_key: str) -> Callable:
+    """Load (and cache) the function identified by func_key in a WorkerPool process"""
+    global pool_funcs
+    func = pool_funcs.get(func_key)
+    if func is None:
+        with open(Path(pool_func_dir) / f"{func_key}.pkl", "rb") as f:
+            func = _SharedUnpickler(f, pool_shared).load()
+        # Only retain the current function; anything expensive should be in pool_shared
+        pool_funcs = {func_key: func}
+    return func
+
+
+def _pool_worker(func_key: str, *args):
+    """Worker function for WorkerPool processes; calls the function identified by func_key
+    with args
+    """
+    return _load_pool_func(func_key)(*args)
+
+
+def _pool_thread_worker(func_key: str, tasks: list) -> list:
+    """Worker function for 'hybrid' WorkerPool processes; maps the function identified by
+    func_key over tasks, using the threads of this process
+    """
+    func = _load_pool_func(func_key)
+    if pool_thread_executor is None:
+        return [func(t) for t in tasks]
+    return list(pool_thread_executor.map(func, tasks))
+
+
+_THREAD_ENV_VARS = ["XLA_FLAGS", "OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+
+
+@contextmanager
+def _thread_env(n_threads: int):
+    """Limit the threads used by each XLA (and OpenMP/BLAS) computation in processes started
+    within this context, restoring the environment afterwards
+    Child processes inherit the environment when started, so the limits are in place before
+    they import anything (which may initialize the XLA backend)
+    """
+    saved = {var: os.environ.get(var) for var in _THREAD_ENV_VARS}
+    xla_flags = os.environ.get("XLA_FLAGS", "")
+    os.environ["XLA_FLAGS"] = (
+        f"{xla_flags} --xla_cpu_multi_thread_eigen=false intra_op_parallelism_threads={n_threads}"
+    ).strip()
+    for var in _THREAD_ENV_VARS[1:]:
+        os.environ[var] = str(n_threads)
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def _get_n_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return int(mp.cpu_count())
+
+
+def _get_cpu_sets(n_procs: int, n_threads: int) -> list:
+    """Split the cpus available to this process into n_procs contiguous blocks of n_threads"""
+    if not hasattr(os, "sched_getaffinity"):
+        return []
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < n_procs * n_threads:
+        # Oversubscribed; don't pin
+        return []
+    return [set(cpus[i * n_threads : (i + 1) * n_threads]) for i in range(n_procs)]
+
+
+class WorkerPool:
+    """A long-lived pool of workers, which can be reused across many calls to map_parallel
+    (by passing the pool as its mode argument)
+
+    Objects supplied as shared (typically a BayesianCompartmentalModel) are sent to each
+    worker process once, at startup, and stay alive (and compiled) for the life of the pool.
+    Functions mapped over the pool can be swapped freely via set_function; any references
+    they hold to the shared objects are resolved to the workers' existing copies, rather than
+    being serialized again
+
+    For example:
+
+    with WorkerPool(shared=[bcm]) as pool:
+        extras = likelihood_extras_for_samples(samples, bcm, exec_mode=pool)
+        results = model_results_for_samples(samples, bcm, exec_mode=pool)
+    """
+
+    def __init__(
+        self,
+        run_func: Optional[Callable] = None,
+        n_workers: Optional[int] = None,
+        mode: str = "process",
+        shared: Sequence = (),
+        n_threads: Optional[int] = None,
+    ):
+        """
+        Args:
+            run_func (optional): The initial function to map (see set_function)
+            n_workers: Number of workers (processes in 'hybrid' mode); defaults to cpu_count,
+                       or the number of cpus divided by n_threads in 'hybrid' mode
+            mode: Either 'thread', 'process' or 'hybrid' (see map_parallel)
+            shared: Objects to keep alive in each worker for the lifetime of the pool
+            n_threads (optional): Threads per process in 'hybrid' mode; defaults to the
+                                  number of available cpus divided by n_workers
+        """
+        if mode == "hybrid":
+            n_cpus = _get_n_cpus()
+            if n_threads is None:
+                n_threads = max(1, n_cpus // (n_workers or n_cpus))
+            if n_workers is None:
+                n_workers = max(1, n_cpus // n_threads)
+        else:
+            n_threads = 1
+            if n_workers is None:
+                n_workers = int(mp.cpu_count())
+
+        self.mode = mode
+        self.n_processes = n_workers
+        self.n_threads = n_threads
+        # Total number of concurrent evaluations, as used for chunking by map_parallel
+        self.n_workers = n_workers * n_threads
+        self.shared = list(shared)
+        self._func_dir = None
+
+        if mode in ["process", "hybrid"]:
+            self._func_dir = tempfile.mkdtemp(prefix="estival_pool_")
+            initargs = (cloudpickle.dumps(self.shared), self._func_dir)
+            # Workers must be spawned (rather than forked); forking a process in which jax
+            # is initialized can deadlock, and hybrid workers' thread settings must apply
+            # to a fresh XLA runtime (see _thread_env)
+            ctx = mp.get_context("spawn")
+            if mode == "hybrid":
+                cpu_sets = _get_cpu_sets(n_workers, n_threads)
+                initargs = initargs + (n_threads, cpu_sets, ctx.Value("i", 0))
+                with _thread_env(1):
+                    self._executor = ProcessPoolExecutor(
+                        n_workers, mp_context=ctx, initializer=_pool_init, initargs=initargs
+                    )
+            else:
+                self._executor = ProcessPoolExecutor(
+                    n_workers, mp_context=ctx, initializer=_pool_init, initargs=initargs
+                )
+        elif mode == "thread":
+            self._executor = ThreadPoolExecutor(n_workers)
+        else:
+            raise ValueError("Mode must be one of ['thread', 'process', 'hybrid']")
+
+        self.run_func = None
+        self._func_key = None
+        if run_func is not None:
+            self.set_function(run_func)
+
+    def set_function(self, run_func: Callable):
+        """Set the function to be called by map, without restarting the pool
+
+        Args:
+            run_func: The function to call over the mapped inputs
+        """
+        if run_func is self.run_func:
+            return
+        self.run_func = run_func
+        if self._func_dir is not None:
+            func_pkl = _dumps_shared(run_func, self.shared)
+            self._func_key = hashlib.sha1(func_pkl).hexdigest()
+            func_path = Path(self._func_dir) / f"{self._func_key}.pkl"
+            if not func_path.exists():
+                # Write then rename, so that workers never observe a partial file
+                tmp_path = func_path.with_suffix(".tmp")
+                tmp_path.write_bytes(func_pkl)
+                tmp_path.replace(func_path)
+
+    def map(self, input_iterator: Iterable) -> list:
+        """Map the values of input_iterator over the current function
+
+        Args:
+            input_iterator: An iterable containing the values to map
+
+        Returns:
+            A list of values returned by the function
+        """
+        if self.run_func is None:
+            raise ValueError("No function set; call set_function first")
+        if self.mode == "hybrid":
+            # Each process task runs one input per thread
+            tasks = list(input_iterator)
+            groups = [tasks[i : i + self.n_threads] for i in range(0, len(tasks), self.n_threads)]
+            # Worker processes are started on demand, so must also inherit the thread settings
+            with _thread_env(1):
+                pres = self._executor.map(partial(_pool_thread_worker, self._func_key), groups)
+                return [p for group_res in pres for p in group_res]
+        elif self.mode == "process":
+            pres = self._executor.map(partial(_pool_worker, self._func_key), input_iterator)
+        else:
+            pres = self._executor.map(self.run_func, input_iterator)
+        return [p for p in pres]
+
+    def close(self):
+        """Shut down the pool's workers"""
+        self._executor.shutdown()
+        if self._func_dir is not None:
+            shutil.rmtree(self._func_dir, ignore_errors=True)
+            self._func_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _map_chunk(run_func: Callable, chunk: list) -> list:
+    """Call run_func on each item of a chunk (ie as a task of a chunked map_parallel)"""
+    return [run_func(item) for item in chunk]
+
+
+def get_chunksize(n_items: int, n_workers: int, chunksize: Optional[int] = None) -> int:
+    """Return the number of items per task for a chunked map
+
+    Args:
+        n_items: Total number of items being mapped
+        n_workers: Number of parallel workers
+        chunksize (optional): Requested chunksize; if None, aim for 4 tasks per worker,
+                              which amortizes the per-task overhead while still balancing load
+
+    Returns:
+        The chunksize (at least 1)
+    """
+    if chunksize is None:
+        chunksize = math.ceil(n_items / (n_workers * 4))
+    return max(1, int(chunksize))
+
+
 def map_parallel(
     run_func: Callable,
     input_iterator: Iterable,
     n_workers: Optional[int] = None,
-    mode: Optional[str] = "process",
+    mode: Optional[Union[str, WorkerPool]] = "process",
+    chunksize: Optional[int] = None,
+    batch_func: Optional[Callable] = None,
+    n_threads: Optional[int] = None,
 ):
     """Map the values of input_iterator over a function run_func, using n_workers parallel workers
     Defaults to ProcessPoolExecutor; for non-Python-bound tasks, 'thread'
 
+    Inputs are submitted in contiguous chunks, such that each task (and its associated IPC
+    round trip) covers many inputs; results are always returned in input order
+
     Args:
         run_func: The function to call over the mapped inputs
         input_iterator: An iterable containing the values to map
         n_workers: Number of processes used by Pool
-        mode: ProcessExecutor type; either 'thread' or 'process'.  'process' is required for
-              non-thread-safe tasks, while 'thread' is usually faster for small jax-heavy tasks
+        mode: ProcessExecutor type; either 'thread', 'process' or 'distributed'.  'process' is
+              required for non-thread-safe tasks, while 'thread' is usually faster for small
+              jax-heavy tasks.  'hybrid' runs n_workers processes of n_threads threads each,
+              with each process pinned to its own cpus and single-threaded XLA computations,
+              so that all cores can be used without contention.
+              'distributed' runs n_workers localhost workers of a DistributedPool
+              (see estival.utils.distributed)
+              Alternatively, an existing WorkerPool or DistributedPool (in which case n_workers
+              is ignored)
+        chunksize (optional): Number of inputs per task; if None, this is chosen automatically
+                              (see get_chunksize) for 'process' mode or when batch_func is
+                              supplied, and is otherwise 1
+        batch_func (optional): A function taking a list of inputs and returning a list of
+                               results (equivalent to calling run_func on each); where
+                               supplied, this is called once per chunk in place of run_func
+        n_threads (optional): Threads per process in 'hybrid' mode; defaults to the number of
+                              available cpus divided by n_workers
 
     Returns:
         A list of values return by run_func
     """
 
+    if _is_pool(mode):
+        n_workers = mode.n_workers  # type: ignore
+
+    if mode == "hybrid":
+        with WorkerPool(None, n_workers, "hybrid", n_threads=n_threads) as pool:
+            return map_parallel(
+                run_func, input_iterator, mode=pool, chunksize=chunksize, batch_func=batch_func
+            )
+
     if n_workers is None:
         n_workers = int(mp.cpu_count())
 
     if mode is None:
         mode = "thread"
 
+    if mode == "distributed":
+        from .distributed import DistributedPool
+
+        with DistributedPool(n_local_workers=n_workers) as pool:
+            return map_parallel(
+                run_func, input_iterator, mode=pool, chunksize=chunksize, batch_func=batch_func
+            )
+
+    items = list(input_iterator)
+    if chunksize is None and mode == "thread" and batch_func is None:
+        chunksize = 1
+    chunksize = get_chunksize(len(items), n_workers, chunksize)
+
+    if chunksize == 1 and batch_func is None:
+        return _map_tasks(run_func, items, n_workers, mode)
+
+    chunk_func = batch_func if batch_func is not None else partial(_map_chunk, run_func)
+    chunks = [items[i : i + chunksize] for i in range(0, len(items), chunksize)]
+    pres = _map_tasks(chunk_func, chunks, n_workers, mode)
+
+    return [p for chunk_res in pres for p in chunk_res]
+
+
+def _is_pool(mode) -> bool:
+    # WorkerPool, DistributedPool, or anything else providing the same interface
+    return hasattr(mode, "set_function") and hasattr(mode, "map")
+
+
+def _map_tasks(run_func: Callable, tasks: list, n_workers: int, mode: Union[str, WorkerPool]):
+    if _is_pool(mode):
+        mode.set_function(run_func)
+        return mode.map(tasks)
+
     if mode == "process":
         with ProcessPoolExecutor(  # type: ignore
-            n_workers, initializer=process_init_cloudpickle, initargs=(cloudpickle.dumps(run_func),)
+            n_workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=process_init_cloudpickle,
+            initargs=(cloudpickle.dumps(run_func),),
         ) as pool:
-            pres = pool.map(generic_cpkl_worker, input_iterator)
+            pres = pool.map(generic_cpkl_worker, tasks)
             pres = [p for p in pres]
     elif mode == "thread":
         with ThreadPoolExecutor(n_workers) as pool:  # type: ignore
-            pres = pool.map(run_func, input_iterator)
+            pres = pool.map(run_func, tasks)
             pres = [p for p in pres]
     else:
-        raise ValueError("Mode must be one of ['thread', 'process']")
+        raise ValueError("Mode must be one of ['thread', 'process', 'hybrid', 'distributed']")
 
     return pres
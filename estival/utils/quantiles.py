@@ -0,0 +1,95 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class QuantileSketch:
+    """A mergeable quantile sketch (a simplified KLL sketch), vectorized over an array of
+    independent streams of the given shape; every stream receives one value per sample,
+    so all streams share the same compaction structure.
+
+    Each level of the sketch holds at most capacity values per stream, with values at level h
+    representing 2**h samples.  Quantiles are exact (matching np.quantile) until more than
+    capacity samples have been added; thereafter the rank error shrinks in proportion to
+    1/capacity, and memory is O(capacity * log2(n_samples / capacity)) per stream
+    """
+
+    def __init__(self, shape: Tuple[int, ...], capacity: int = 1024, seed: Optional[int] = None):
+        self.shape = tuple(shape)
+        self.capacity = capacity
+        self.count = 0
+        self._levels: List[np.ndarray] = []
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray):
+        """Add samples to the sketch
+
+        Args:
+            values: Array of shape (*shape, n_samples)
+        """
+        values = np.asarray(values, dtype=float)
+        if values.shape[:-1] != self.shape:
+            raise ValueError(f"Shape mismatch: expected {self.shape} + (n,), got {values.shape}")
+        self._insert(0, values)
+        self.count += values.shape[-1]
+
+    def merge(self, other: "QuantileSketch"):
+        """Merge another sketch (of the same shape) into this one
+
+        Args:
+            other: The sketch to merge
+        """
+        if other.shape != self.shape:
+            raise ValueError(f"Shape mismatch: {self.shape} and {other.shape}")
+        for h, level in enumerate(other._levels):
+            self._insert(h, level)
+        self.count += other.count
+
+    def _insert(self, h: int, values: np.ndarray):
+        while len(self._levels) <= h:
+            self._levels.append(np.empty((*self.shape, 0)))
+
+        buf = np.concatenate([self._levels[h], values], axis=-1)
+        if buf.shape[-1] <= self.capacity:
+            self._levels[h] = buf
+            return
+
+        # Compact: keep every other (sorted) value at double the weight, from a random offset
+        buf = np.sort(buf, axis=-1)
+        n_compact = buf.shape[-1] - buf.shape[-1] % 2
+        offset = self._rng.integers(2)
+        self._levels[h] = buf[..., n_compact:]
+        self._insert(h + 1, buf[..., offset:n_compact:2])
+
+    def quantiles(self, quantiles: Sequence[float]) -> np.ndarray:
+        """Return the (approximate) quantiles of all samples added so far
+
+        Args:
+            quantiles: Quantiles to compute [0.0,1.0]
+
+        Returns:
+            Array of shape (*shape, len(quantiles))
+        """
+        if self.count == 0:
+            raise ValueError("No samples have been added to the sketch")
+
+        if len(self._levels) == 1:
+            return np.moveaxis(np.quantile(self._levels[0], quantiles, axis=-1), 0, -1)
+
+        values = np.concatenate(self._levels, axis=-1)
+        weights = np.concatenate(
+            [np.full(level.shape[-1], 2.0**h) for h, level in enumerate(self._levels)]
+        )
+
+        order = np.argsort(values, axis=-1)
+        sorted_values = np.take_along_axis(values, order, axis=-1)
+        cum_weights = np.cumsum(weights[order], axis=-1)
+        total = cum_weights[..., -1:]
+
+        out = []
+        for q in quantiles:
+            # The smallest value whose cumulative weight reaches the target rank
+            idx = np.sum(cum_weights < q * total, axis=-1, keepdims=True)
+            idx = np.minimum(idx, values.shape[-1] - 1)
+            out.append(np.take_along_axis(sorted_values, idx, axis=-1)[..., 0])
+        return np.stack(out, axis=-1)
@@ -0,0 +1,37 @@
+import pytest
+
+import jax
+
+# Finite difference checks need double precision
+jax.config.update("jax_enable_x64", True)
+
+from summer2.extras import test_models
+
+from estival.model import BayesianCompartmentalModel
+from estival import priors as esp
+from estival import targets as est
+
+
+def build_bcm() -> BayesianCompartmentalModel:
+    m = test_models.sir()
+    defp = m.get_default_parameters()
+    m.run(defp)
+    obs = m.get_derived_outputs_df()["incidence"].iloc[0:50:5]
+
+    priors = [
+        esp.UniformPrior("contact_rate", (0.01, 1.0)),
+        esp.TruncNormalPrior("recovery_rate", 0.5, 0.2, (0.01, 1.0)),
+    ]
+    targets = [est.NormalTarget("incidence", obs, esp.UniformPrior("incidence_sd", (0.1, 10.0)))]
+    return BayesianCompartmentalModel(m, defp, priors, targets)
+
+
+@pytest.fixture(scope="module")
+def bcm():
+    return build_bcm()
+
+
+@pytest.fixture
+def fresh_bcm():
+    """A BCM which has not yet been run (ie whose lazily built components do not exist)"""
+    return build_bcm()
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from estival.utils.aio import AsyncBCM, map_parallel_async
+
+
+def get_params(bcm, n=8) -> list:
+    rng = np.random.default_rng(6)
+    samples = {k: p.ppf(rng.uniform(0.2, 0.8, n)) for k, p in bcm.priors.items()}
+    return [{k: float(v[i]) for k, v in samples.items()} for i in range(n)]
+
+
+class ConcurrencyTracker:
+    """Wraps a function, recording the maximum number of simultaneous calls"""
+
+    def __init__(self, func):
+        self.func = func
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            # Hold the slot long enough for other calls to overlap
+            time.sleep(0.05)
+            return self.func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_async_bcm(bcm, monkeypatch):
+    params = get_params(bcm)
+    expected = [bcm.run(p) for p in params]
+
+    tracker = ConcurrencyTracker(bcm.run)
+    monkeypatch.setattr(bcm, "run", tracker)
+
+    async def run_all():
+        with ThreadPoolExecutor(8) as executor:
+            abcm = AsyncBCM(bcm, executor, max_concurrency=2)
+            runs = await asyncio.gather(*[abcm.run(p) for p in params])
+            lls = await asyncio.gather(*[abcm.loglikelihood(**p) for p in params])
+        return runs, lls
+
+    runs, lls = asyncio.run(run_all())
+
+    # Only run is tracked; loglikelihood calls are limited by the same semaphore
+    assert tracker.max_active == 2
+    for res, ref in zip(runs, expected):
+        np.testing.assert_allclose(res.derived_outputs, ref.derived_outputs)
+        np.testing.assert_allclose(res.extras["logposterior"], ref.extras["logposterior"])
+    np.testing.assert_allclose(lls, [ref.extras["loglikelihood"] for ref in expected])
+
+
+def test_map_parallel_async(bcm):
+    params = get_params(bcm)
+    expected = [float(bcm.loglikelihood(**p)) for p in params]
+    tracker = ConcurrencyTracker(lambda p: float(bcm.loglikelihood(**p)))
+
+    async def run_all():
+        with ThreadPoolExecutor(8) as executor:
+            return await map_parallel_async(tracker, params, executor, max_concurrency=3)
+
+    res = asyncio.run(run_all())
+    assert tracker.max_active == 3
+    np.testing.assert_allclose(res, expected)
@@ -0,0 +1,70 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from estival.model import BayesianCompartmentalModel
+from estival.sampling import tools as esamp
+from estival.utils.distributed import DistributedPool
+from estival.utils.parallel import map_parallel
+
+
+class UnpicklableError(Exception):
+    def __init__(self):
+        super().__init__("unpicklable")
+        self.lock = threading.Lock()
+
+
+def get_params(bcm, n=12) -> list:
+    rng = np.random.default_rng(2)
+    samples = {k: p.ppf(rng.uniform(0.2, 0.8, n)) for k, p in bcm.priors.items()}
+    return [{k: float(v[i]) for k, v in samples.items()} for i in range(n)]
+
+
+def test_distributed_pool(bcm, monkeypatch):
+    params = get_params(bcm)
+    expected = [float(bcm.loglikelihood(**p)) for p in params]
+
+    # Count pickles of the BCM made by this (the head) process
+    n_pickled = 0
+    getstate = BayesianCompartmentalModel.__getstate__
+
+    def counting_getstate(self):
+        nonlocal n_pickled
+        n_pickled += 1
+        return getstate(self)
+
+    monkeypatch.setattr(BayesianCompartmentalModel, "__getstate__", counting_getstate)
+
+    with DistributedPool(shared=[bcm], n_local_workers=2) as pool:
+        res = map_parallel(lambda p: float(bcm.loglikelihood(**p)), params, mode=pool, chunksize=3)
+        np.testing.assert_allclose(res, expected, rtol=1e-8)
+
+        # Swapping the function does not resend the BCM
+        res = map_parallel(lambda p: float(bcm.logposterior(**p)), params, mode=pool)
+        np.testing.assert_allclose(res, [bcm.logposterior(**p) for p in params], rtol=1e-8)
+        assert n_pickled == 1
+
+        def fails(p):
+            return bcm.run(p).extras["not_an_extra"]
+
+        with pytest.raises(KeyError, match="not_an_extra"):
+            map_parallel(fails, params[:4], mode=pool)
+
+        def fails_unpicklable(p):
+            raise UnpicklableError()
+
+        with pytest.raises(RuntimeError, match="UnpicklableError"):
+            map_parallel(fails_unpicklable, params[:2], mode=pool)
+
+        # The pool remains usable after failures
+        res = map_parallel(lambda p: float(bcm.loglikelihood(**p)), params, mode=pool)
+        np.testing.assert_allclose(res, expected, rtol=1e-8)
+
+
+def test_distributed_mode(bcm):
+    samples = pd.DataFrame(get_params(bcm))
+    expected = esamp.likelihood_extras_for_samples(samples, bcm, 1, "thread")
+    res = esamp.likelihood_extras_for_samples(samples, bcm, 2, "distributed")
+    pd.testing.assert_frame_equal(res, expected)
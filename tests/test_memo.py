@@ -0,0 +1,61 @@
+import pickle
+
+import numpy as np
+
+from estival.utils.memo import LRUCache, hash_parameters
+
+
+def test_hash_parameters():
+    params = {"a": 1.0, "b": np.arange(3.0)}
+    assert hash_parameters(params) == hash_parameters({"b": np.arange(3.0), "a": 1.0})
+    assert hash_parameters(params) != hash_parameters({**params, "a": 1.0 + 1e-12})
+    assert hash_parameters(params, "run") != hash_parameters(params, "loglikelihood")
+
+
+def test_lru_eviction():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    # Touch a, such that b is the least recently used
+    assert cache.get("a") == (True, 1)
+    cache.put("c", 3)
+
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("c") == (True, 3)
+    assert len(cache) == 2
+
+
+def test_lru_max_bytes():
+    cache = LRUCache(max_entries=10, max_bytes=100)
+    cache.put("a", "a", 40)
+    cache.put("b", "b", 40)
+    cache.put("c", "c", 40)
+    assert cache.get("a") == (False, None)
+    assert cache.info().nbytes == 80
+
+    # Values larger than max_bytes are never stored
+    cache.put("d", "d", 101)
+    assert cache.get("d") == (False, None)
+    assert len(cache) == 2
+
+    # Replacing an entry updates its size
+    cache.put("b", "b2", 10)
+    assert cache.info().nbytes == 50
+
+
+def test_lru_info():
+    cache = LRUCache(max_entries=4)
+    cache.put("a", 1, 8)
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+
+    info = cache.info()
+    assert (info.hits, info.misses, info.entries, info.nbytes) == (2, 1, 1, 8)
+
+    # Pickling (ie sending to a worker) preserves contents, and the cache remains usable
+    restored = pickle.loads(pickle.dumps(cache))
+    assert restored.get("a") == (True, 1)
+    restored.put("c", 3)
+    assert len(restored) == 2
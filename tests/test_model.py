@@ -0,0 +1,146 @@
+import pytest
+
+import numpy as np
+
+import jax
+from jax import numpy as jnp
+from summer2.extras import test_models
+
+from estival import priors as esp
+from estival import targets as est
+from estival import transforms as etr
+from estival.model import BayesianCompartmentalModel
+
+
+def get_samples(bcm, n=6) -> dict:
+    rng = np.random.default_rng(0)
+    return {k: p.ppf(rng.uniform(0.2, 0.8, n)) for k, p in bcm.priors.items()}
+
+
+def get_sample(samples: dict, i: int) -> dict:
+    return {k: float(v[i]) for k, v in samples.items()}
+
+
+@pytest.mark.parametrize("batch_size", [None, 4])
+def test_loglikelihood_batch(bcm, batch_size):
+    samples = get_samples(bcm)
+    n = len(samples["contact_rate"])
+
+    expected_ll = [bcm.loglikelihood(**get_sample(samples, i)) for i in range(n)]
+    expected_lp = [bcm.logposterior(**get_sample(samples, i)) for i in range(n)]
+
+    ll = bcm.loglikelihood_batch(samples, batch_size=batch_size)
+    lp = bcm.logposterior_batch(samples, batch_size=batch_size)
+    np.testing.assert_allclose(ll, expected_ll, rtol=1e-8)
+    np.testing.assert_allclose(lp, expected_lp, rtol=1e-8)
+
+
+def test_logposterior_and_grad(bcm):
+    params = get_sample(get_samples(bcm), 0)
+
+    lp, grad = bcm.logposterior_and_grad(params)
+    np.testing.assert_allclose(lp, bcm.logposterior(**params), rtol=1e-8)
+
+    for k, v in params.items():
+        h = 1e-6 * max(abs(v), 1.0)
+        lp_hi = bcm.logposterior(**{**params, k: v + h})
+        lp_lo = bcm.logposterior(**{**params, k: v - h})
+        np.testing.assert_allclose(grad[k], (lp_hi - lp_lo) / (2 * h), rtol=1e-4, atol=1e-6)
+
+
+def test_run_batch(bcm):
+    samples = get_samples(bcm)
+    n = len(samples["contact_rate"])
+
+    bres = bcm.run_batch(samples, include_extras=True, batch_size=4)
+
+    for i in range(n):
+        res = bcm.run(get_sample(samples, i))
+        expected_do = res.derived_outputs[bres.outputs].to_numpy()
+        np.testing.assert_allclose(bres.derived_outputs[i], expected_do, rtol=1e-8)
+        for k in ["loglikelihood", "logprior", "logposterior"]:
+            np.testing.assert_allclose(bres.extras[k][i], res.extras[k], rtol=1e-8)
+        for k, v in res.extras["ll_components"].items():
+            np.testing.assert_allclose(bres.extras["ll_components"][k][i], v, rtol=1e-8)
+
+
+def test_cache(bcm):
+    params = get_sample(get_samples(bcm), 1)
+    expected_lp = bcm.logposterior(**params)
+
+    bcm.enable_cache(max_entries=16)
+    try:
+        # Repeated evaluations (ie re-asked points in an optimizer) hit the cache
+        for _ in range(3):
+            np.testing.assert_allclose(bcm.logposterior(**params), expected_lp)
+        bcm.loglikelihood(**params)
+        bcm.loglikelihood(**params)
+
+        info = bcm.cache_info()
+        assert (info.hits, info.misses) == (3, 2)
+    finally:
+        bcm.disable_cache()
+    assert bcm.cache_info() is None
+
+
+def test_run_jax_fresh(fresh_bcm):
+    # The full runner is first built inside a trace
+    params = get_sample(get_samples(fresh_bcm), 0)
+    run_params = {k: v for k, v in params.items() if k in fresh_bcm._model_parameters}
+    shapes = jax.eval_shape(fresh_bcm.run_jax, run_params)["derived_outputs"]
+    res = jax.jit(fresh_bcm.run_jax)(run_params)["derived_outputs"]
+
+    expected = fresh_bcm.run(params, include_extras=False).derived_outputs
+    assert list(shapes) == list(expected.columns)
+    for k, v in res.items():
+        assert shapes[k].shape == v.shape
+        np.testing.assert_allclose(v, expected[k].to_numpy(), rtol=1e-8)
+
+
+def test_run_threaded_fresh(fresh_bcm):
+    from estival.utils.parallel import map_parallel
+
+    samples = get_samples(fresh_bcm, 8)
+    params = [get_sample(samples, i) for i in range(8)]
+    runs = map_parallel(lambda p: fresh_bcm.run(p).derived_outputs, params, 4, mode="thread")
+
+    for p, do in zip(params, runs):
+        np.testing.assert_allclose(do, fresh_bcm.run(p).derived_outputs, rtol=1e-8)
+
+
+def test_logposterior_unconstrained():
+    m = test_models.sir()
+    defp = m.get_default_parameters()
+    m.run(defp)
+    obs = m.get_derived_outputs_df()["incidence"].iloc[0:50:5]
+
+    # Bounded, and half-bounded (below) priors
+    priors = [
+        esp.UniformPrior("contact_rate", (0.01, 1.0)),
+        esp.GammaPrior("recovery_rate", 2.0, 0.2),
+    ]
+    sd_prior = esp.TruncNormalPrior("incidence_sd", 1.0, 2.0, (0.1, np.inf))
+    targets = [est.NormalTarget("incidence", obs, sd_prior)]
+    bcm = BayesianCompartmentalModel(m, defp, priors, targets)
+
+    assert isinstance(bcm.transforms["contact_rate"], etr.IntervalTransform)
+    assert isinstance(bcm.transforms["recovery_rate"], etr.LowerBoundTransform)
+    assert isinstance(bcm.transforms["incidence_sd"], etr.LowerBoundTransform)
+
+    keys = list(bcm.transforms)
+
+    def inverse(zv):
+        return jnp.stack([bcm.transforms[k].inverse(zv[i]) for i, k in enumerate(keys)])
+
+    samples = get_samples(bcm, 4)
+    for i in range(4):
+        params = get_sample(samples, i)
+        z = bcm.to_unconstrained(params)
+        zv = jnp.array([z[k] for k in keys])
+
+        # log|det J| of the inverse transform, independently of inverse_log_det_jacobian
+        _, log_det = jnp.linalg.slogdet(jax.jacfwd(inverse)(zv))
+        expected = bcm.logposterior(**bcm.from_unconstrained(z)) + log_det
+        np.testing.assert_allclose(bcm.logposterior_unconstrained(z), expected, rtol=1e-8)
+        x = bcm.from_unconstrained(z)
+        np.testing.assert_allclose([x[k] for k in keys], [params[k] for k in keys], rtol=1e-8)
@@ -1,5 +1,10 @@
 import pytest
 
+import numpy as np
+from scipy import stats
+
+import jax
+
 
 from estival import priors as esp
 
@@ -31,3 +36,39 @@ def test_get_series(prior_type: str, fit_func: str):
     p = get_test_prior(prior_type)
 
     p.get_series(fit_func)
+
+
+@pytest.mark.parametrize("prior_type", PRIORS)
+def test_logpdf_jax(prior_type: str):
+    p = get_test_prior(prior_type)
+
+    x = np.linspace(*p.finite_bounds(0.99), 11)
+    np.testing.assert_allclose(p.logpdf_jax(x), p.logpdf(x), rtol=1e-5)
+
+
+@pytest.mark.parametrize("prior_type", PRIORS)
+def test_transform_roundtrip(prior_type: str):
+    p = get_test_prior(prior_type)
+    t = p.get_transform()
+
+    x = np.linspace(*p.finite_bounds(0.99), 11)[1:-1]
+    z = t.forward(x)
+    assert np.all(np.isfinite(z))
+    np.testing.assert_allclose(t.inverse(z), x, rtol=1e-5)
+
+
+class _ScipyOnlyPrior(esp.BasePrior):
+    """A custom prior which only provides the (default) scipy implementation"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._rv = stats.expon(scale=2.0)
+
+
+def test_logpdf_jax_scipy_fallback():
+    p = _ScipyOnlyPrior("x")
+
+    x = np.linspace(0.1, 5.0, 11)
+    np.testing.assert_allclose(p.logpdf_jax(x), p.logpdf(x), rtol=1e-5)
+    np.testing.assert_allclose(jax.jit(p.logpdf_jax)(x), p.logpdf(x), rtol=1e-5)
+    np.testing.assert_allclose(jax.vmap(p.logpdf_jax)(x), p.logpdf(x), rtol=1e-5)
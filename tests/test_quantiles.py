@@ -0,0 +1,34 @@
+import numpy as np
+
+from estival.utils.quantiles import QuantileSketch
+
+QUANTILES = [0.025, 0.25, 0.5, 0.75, 0.975]
+
+
+def test_sketch_exact_below_capacity():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(3, 4, 100))
+
+    sketch = QuantileSketch((3, 4), capacity=128)
+    sketch.update(values[..., :60])
+    sketch.update(values[..., 60:])
+
+    expected = np.moveaxis(np.quantile(values, QUANTILES, axis=-1), 0, -1)
+    np.testing.assert_allclose(sketch.quantiles(QUANTILES), expected)
+
+
+def test_sketch_merge_approximate():
+    rng = np.random.default_rng(0)
+    values = rng.uniform(size=(2, 5, 20000))
+
+    sketch_a = QuantileSketch((2, 5), capacity=256, seed=1)
+    sketch_b = QuantileSketch((2, 5), capacity=256, seed=2)
+    for chunk in np.split(values[..., :10000], 10, axis=-1):
+        sketch_a.update(chunk)
+    for chunk in np.split(values[..., 10000:], 10, axis=-1):
+        sketch_b.update(chunk)
+    sketch_a.merge(sketch_b)
+
+    assert sketch_a.count == 20000
+    expected = np.moveaxis(np.quantile(values, QUANTILES, axis=-1), 0, -1)
+    np.testing.assert_allclose(sketch_a.quantiles(QUANTILES), expected, atol=0.02)
@@ -0,0 +1,291 @@
+import pytest
+
+import numpy as np
+import pandas as pd
+import arviz as az
+
+from estival.sampling import tools as esamp
+from estival.utils.parallel import WorkerPool
+
+
+def get_samples_df(bcm, n=10) -> pd.DataFrame:
+    rng = np.random.default_rng(1)
+    return pd.DataFrame({k: p.ppf(rng.uniform(0.2, 0.8, n)) for k, p in bcm.priors.items()})
+
+
+def test_checkpoint_resume(bcm, tmp_path, monkeypatch):
+    samples = get_samples_df(bcm)
+    expected = esamp.likelihood_extras_for_samples(samples, bcm, 1, "thread")
+
+    run = bcm.run
+    n_calls = 0
+
+    def counting_run(*args, **kwargs):
+        nonlocal n_calls
+        n_calls += 1
+        if fail_after is not None and n_calls > fail_after:
+            raise RuntimeError("interrupted")
+        return run(*args, **kwargs)
+
+    monkeypatch.setattr(bcm, "run", counting_run)
+
+    # Interrupt partway through the third block; the first two are checkpointed
+    fail_after = 7
+    with pytest.raises(RuntimeError, match="interrupted"):
+        esamp.likelihood_extras_for_samples(
+            samples, bcm, 1, "thread", checkpoint=tmp_path, checkpoint_every=3
+        )
+    assert len(list(tmp_path.glob("block_*.pkl"))) == 2
+
+    # Only the remaining samples are evaluated when resuming
+    fail_after = None
+    n_calls = 0
+    resumed = esamp.likelihood_extras_for_samples(
+        samples, bcm, 1, "thread", checkpoint=tmp_path, checkpoint_every=3, resume=True
+    )
+    assert n_calls == 4
+    pd.testing.assert_frame_equal(resumed, expected)
+
+
+@pytest.mark.parametrize("exec_mode", ["thread", "process"])
+def test_shared_memory_results(fresh_bcm, exec_mode):
+    # The output shape is determined before the model has ever been run
+    samples = get_samples_df(fresh_bcm)
+    results = []
+
+    # Workers of a persistent pool are reused across runs, each with a new segment
+    with WorkerPool(n_workers=2, mode=exec_mode, shared=[fresh_bcm]) as pool:
+        for _ in range(2):
+            results.append(
+                esamp.model_results_for_samples(
+                    samples, fresh_bcm, True, exec_mode=pool, shared_memory=True
+                )
+            )
+
+    expected = esamp.model_results_for_samples(samples, fresh_bcm, True, 1, "thread")
+    for res in results:
+        pd.testing.assert_frame_equal(res.results, expected.results, check_like=True)
+        pd.testing.assert_frame_equal(res.extras, expected.extras)
+
+
+@pytest.mark.parametrize("index_kind", ["unnamed", "named", "multi"])
+def test_results_hdf5_roundtrip(bcm, tmp_path, index_kind):
+    samples = get_samples_df(bcm, 8)
+    if index_kind == "named":
+        samples.index = samples.index.rename("draw")
+    elif index_kind == "multi":
+        samples.index = pd.MultiIndex.from_product([[0, 1], range(4)], names=["chain", "draw"])
+    expected = esamp.model_results_for_samples(samples, bcm, True)
+
+    out_file = tmp_path / "results.h5"
+    esamp.model_results_to_hdf5(samples, bcm, out_file, chunk_size=3)
+    res = esamp.load_results_hdf5(out_file)
+
+    pd.testing.assert_frame_equal(res.results, expected.results, check_like=True)
+    pd.testing.assert_frame_equal(res.extras, expected.extras)
+
+
+def make_idata(bcm, n_chains=2, n_draws=12) -> az.InferenceData:
+    """An MCMC-like trace, in which rejected draws repeat the chain's previous draw"""
+    rng = np.random.default_rng(3)
+    accepted = rng.uniform(size=(n_chains, n_draws)) < 0.5
+    accepted[:, 0] = True
+    # Positions of the last accepted draw of each chain
+    last = np.maximum.accumulate(np.where(accepted, np.arange(n_draws), 0), axis=1)
+
+    posterior = {}
+    for k, p in bcm.priors.items():
+        values = p.ppf(rng.uniform(0.2, 0.8, (n_chains, n_draws)))
+        posterior[k] = np.take_along_axis(values, last, axis=1)
+    return az.from_dict(posterior=posterior, sample_stats={"accepted": accepted})
+
+
+def get_draw_samples(idata) -> pd.DataFrame:
+    return idata["posterior"].to_dataframe()
+
+
+def test_extras_for_idata_forward_fill(bcm):
+    idata = make_idata(bcm)
+    assert not idata["sample_stats"].accepted.all()
+
+    extras = esamp.likelihood_extras_for_idata(idata, bcm, 1)
+
+    # Rejected draws repeat their predecessor, so evaluating every draw directly is equivalent
+    expected = esamp.likelihood_extras_for_samples(get_draw_samples(idata), bcm, 1)
+    pd.testing.assert_frame_equal(extras, expected, check_like=True)
+
+
+def test_extras_for_idata_incremental(bcm, monkeypatch):
+    idata = make_idata(bcm)
+    n_draws = idata["posterior"].sizes["draw"]
+    partial_idata = idata.isel(draw=slice(0, 8))
+    previous = esamp.likelihood_extras_for_idata(partial_idata, bcm, 1)
+
+    run = bcm.run
+    evaluated = []
+
+    def counting_run(params, *args, **kwargs):
+        evaluated.append(params)
+        return run(params, *args, **kwargs)
+
+    monkeypatch.setattr(bcm, "run", counting_run)
+    extras = esamp.likelihood_extras_for_idata(idata, bcm, 1, previous_extras=previous)
+
+    # Only draws accepted after the previous call are evaluated
+    accepted = idata["sample_stats"].accepted.to_numpy()
+    assert len(evaluated) == accepted[:, 8:n_draws].sum()
+
+    monkeypatch.undo()
+    expected = esamp.likelihood_extras_for_idata(idata, bcm, 1)
+    pd.testing.assert_frame_equal(extras, expected)
+
+
+def make_sample_iterator(n=10) -> esamp.SampleIterator:
+    rng = np.random.default_rng(4)
+    components = {"a": rng.normal(size=n), "b": rng.normal(size=(n, 3)), "c": rng.normal(size=n)}
+    index = pd.MultiIndex.from_product([[0, 1], range(n // 2)], names=["chain", "draw"])
+    return esamp.SampleIterator(components, index=index)
+
+
+def test_iter_batches():
+    si = make_sample_iterator()
+    rows = list(si.iterrows())
+
+    batches = list(si.iter_batches(4))
+    assert [len(idx) for idx, _ in batches] == [4, 4, 2]
+    for idx, batch in batches:
+        for k, v in batch.items():
+            # Batches are views of the components
+            assert np.shares_memory(v, si.components[k])
+    assert si._block is None
+
+    # The contiguous block is only built on request
+    array_batches = list(si.iter_batches(4, as_array=True))
+    assert si._block is not None
+    block = np.concatenate([b for _, b in array_batches])
+    np.testing.assert_array_equal(block, si.to_array())
+    for _, b in array_batches:
+        assert np.shares_memory(b, si._block)
+
+    # Components are now views of the block, and iterate as before
+    for k, v in si.components.items():
+        assert np.shares_memory(v, si._block)
+    for (idx, row), (ref_idx, ref_row) in zip(si.iterrows(), rows):
+        assert idx == ref_idx
+        for k in row:
+            np.testing.assert_array_equal(row[k], ref_row[k])
+
+
+def test_iter_batches_unpackable():
+    si = esamp.SampleIterator({"a": np.arange(4), "b": np.linspace(0.0, 1.0, 4)})
+    with pytest.raises(TypeError, match="contiguously"):
+        next(si.iter_batches(2, as_array=True))
+    assert len(list(si.iter_batches(3))) == 2
+
+
+def assert_sample_iterators_equal(si, ref):
+    pd.testing.assert_index_equal(si.index, ref.index)
+    assert list(si.components) == list(ref.components)
+    for k, v in ref.components.items():
+        np.testing.assert_array_equal(np.asarray(si.components[k]), v)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_sample_iterator_hdf5(tmp_path, lazy):
+    h5py = pytest.importorskip("h5py")
+
+    ref = make_sample_iterator()
+    ref.to_hdf5(tmp_path / "samples.h5", chunk_rows=3)
+    si = esamp.SampleIterator.read_hdf5(tmp_path / "samples.h5", lazy=lazy)
+    try:
+        if lazy:
+            assert all([isinstance(v, h5py.Dataset) for v in si.components.values()])
+            assert si._iter_batch_size == 3
+        assert_sample_iterators_equal(si, ref)
+
+        for (idx, row), (ref_idx, ref_row) in zip(si.iterrows(), ref.iterrows()):
+            assert idx == ref_idx
+            for k in row:
+                np.testing.assert_array_equal(row[k], ref_row[k])
+
+        # Subsets (including unordered rows) are loaded into memory
+        assert_sample_iterators_equal(si.iloc[[7, 2, 3]], ref.iloc[[7, 2, 3]])
+        assert_sample_iterators_equal(si.iloc[2:6], ref.iloc[2:6])
+        assert_sample_iterators_equal(si.loc[1], ref.loc[1])
+        for k, v in si.iloc[[7, 2, 3]].components.items():
+            assert isinstance(v, np.ndarray)
+
+        for (idx, batch), (ref_idx, ref_batch) in zip(si.iter_batches(4), ref.iter_batches(4)):
+            pd.testing.assert_index_equal(idx, ref_idx)
+            for k, v in batch.items():
+                np.testing.assert_array_equal(v, ref_batch[k])
+    finally:
+        si.close()
+
+
+def make_results(n_samples=6) -> esamp.SampledResults:
+    rng = np.random.default_rng(5)
+    samples = pd.MultiIndex.from_product([[0, 1], range(n_samples // 2)], names=["chain", "draw"])
+    times = pd.Index(np.arange(5.0), name="time")
+    data = rng.normal(size=(2, len(times), n_samples))
+    extras = pd.DataFrame({"loglikelihood": rng.normal(size=n_samples)}, index=samples)
+    return esamp.SampledResults(esamp.ResultsArray(data, ["x", "y"], times, samples), extras)
+
+
+def test_sample_iterator_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+
+    ref = make_sample_iterator()
+    ref.to_parquet(tmp_path / "samples.parquet")
+    si = esamp.SampleIterator.read_parquet(tmp_path / "samples.parquet")
+    assert_sample_iterators_equal(si, ref)
+    assert si.components["b"].shape == (10, 3)
+
+
+def test_results_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+
+    ref = make_results()
+    ref.to_parquet(tmp_path / "results.parquet", tmp_path / "extras.parquet")
+
+    res = esamp.SampledResults.read_parquet(
+        tmp_path / "results.parquet", tmp_path / "extras.parquet", as_array=True
+    )
+    np.testing.assert_array_equal(res.results.data, ref.results.data)
+    assert res.results.variables == ref.results.variables
+    pd.testing.assert_index_equal(res.results.times, ref.results.times)
+    pd.testing.assert_index_equal(res.results.samples, ref.results.samples)
+    pd.testing.assert_frame_equal(res.extras, ref.extras)
+
+    # DataFrame results are written via a ResultsArray
+    df_ref = esamp.SampledResults(ref.results.to_dataframe(), None)
+    df_ref.to_parquet(tmp_path / "results_df.parquet")
+    res = esamp.SampledResults.read_parquet(tmp_path / "results_df.parquet")
+    pd.testing.assert_frame_equal(res.results, df_ref.results)
+    assert res.extras is None
+
+
+def test_results_array_float32(bcm):
+    samples = get_samples_df(bcm, 20)
+    expected = esamp.model_results_for_samples(samples, bcm, False).results
+    res = esamp.model_results_for_samples(samples, bcm, False, as_array=True, dtype=np.float32)
+    results = res.results
+
+    assert isinstance(results, esamp.ResultsArray)
+    assert results.data.dtype == np.float32
+    assert results.nbytes == results.astype(np.float64).nbytes // 2
+
+    df = results.to_dataframe()
+    pd.testing.assert_frame_equal(df, expected, check_like=True, check_dtype=False, rtol=1e-6)
+    for v in results.variables:
+        pd.testing.assert_frame_equal(results[v], expected[v], check_dtype=False, rtol=1e-6)
+
+    # Round trip via the DataFrame layout
+    rt = esamp.ResultsArray.from_dataframe(df, dtype=np.float32)
+    np.testing.assert_array_equal(rt.data, results.data)
+    assert rt.variables == results.variables
+
+    quantiles = (0.05, 0.5, 0.95)
+    expected_q = esamp.quantiles_for_results(expected, quantiles)
+    q = results.quantiles(quantiles)[expected_q.columns]
+    np.testing.assert_allclose(q.to_numpy(), expected_q.to_numpy(dtype=float), rtol=1e-5)
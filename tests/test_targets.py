@@ -0,0 +1,187 @@
+import pytest
+
+import numpy as np
+import pandas as pd
+
+import jax
+from jax import numpy as jnp, scipy as jsp
+from tensorflow_probability.substrates.jax import distributions as tfpd
+
+from estival import priors as esp
+from estival import targets as est
+
+MODEL_TIMES = pd.Index(np.arange(50.0))
+FAMILIES = ["negbin", "binomial", "beta", "normal", "truncnormal"]
+
+
+def reference_logpdf(ev: est.TargetEvaluator, modelled, parameters: dict):
+    """The elementwise loglikelihood of each evaluator, as computed by the library
+    distributions used prior to the ll_kernel implementations
+    """
+    m = modelled[ev.index]
+    if isinstance(ev, est.NegativeBinomialEvaluator):
+        n = ev.get_distri_param()
+        n = parameters[n.name] if isinstance(n, esp.BasePrior) else n
+        p = m / (m + n)
+        p = jnp.where(p < 1e-16, 1e-16, p)
+        return jsp.stats.nbinom.logpmf(ev.data, n, 1.0 - p)
+    elif isinstance(ev, est.BinomialEvaluator):
+        n = ev.target.sample_sizes.to_numpy()
+        return tfpd.Binomial(total_count=n, probs=m).log_prob(ev.data * n)
+    elif isinstance(ev, est.BetaEvaluator):
+        return tfpd.Beta(ev.target.a.to_numpy(), ev.target.b.to_numpy()).log_prob(m)
+
+    sd = ev.get_distri_param()
+    sd = parameters[sd.name] if isinstance(sd, esp.BasePrior) else sd
+    if isinstance(ev, est.NormalTargetEvaluator):
+        return jsp.stats.norm.logpdf(ev.data, loc=m, scale=sd)
+    elif isinstance(ev, est.TruncatedNormalTargetEvaluator):
+        low, high = ev.target.trunc_range
+        return tfpd.TruncatedNormal(loc=m, scale=sd, low=low, high=high).log_prob(ev.data)
+    raise TypeError(ev)
+
+
+def reference_evaluate(ev: est.TargetEvaluator, modelled, parameters: dict):
+    ll = reference_logpdf(ev, modelled, parameters)
+    if ev.time_weights is not None:
+        return jnp.sum(ll * ev.time_weights) * ev.target.weight
+    else:
+        return jnp.mean(ll) * ev.target.weight
+
+
+def make_target(family: str, name: str, idx: pd.Index, rng, time_weighted: bool, param):
+    size = len(idx)
+    tw = pd.Series(rng.uniform(0.5, 1.5, size), index=idx) if time_weighted else None
+    if family == "negbin":
+        data = pd.Series(rng.poisson(20.0, size).astype(float), index=idx)
+        return est.NegativeBinomialTarget(name, data, param, 0.5, tw, model_key=name)
+    elif family == "binomial":
+        data = pd.Series(rng.uniform(0.1, 0.9, size), index=idx)
+        sample_sizes = pd.Series(100.0, index=idx)
+        return est.BinomialTarget(name, data, sample_sizes, 0.5, tw, model_key=name)
+    elif family == "beta":
+        data = pd.Series(rng.uniform(0.1, 0.9, size), index=idx)
+        a = pd.Series(rng.uniform(1.0, 5.0, size), index=idx)
+        b = pd.Series(rng.uniform(1.0, 5.0, size), index=idx)
+        return est.BetaTarget(name, data, a, b, 0.5, tw, model_key=name)
+    elif family == "normal":
+        data = pd.Series(rng.uniform(5.0, 30.0, size), index=idx)
+        return est.NormalTarget(name, data, param, 0.5, tw, model_key=name)
+    elif family == "truncnormal":
+        data = pd.Series(rng.uniform(5.0, 30.0, size), index=idx)
+        return est.TruncatedNormalTarget(name, data, (0.0, np.inf), param, 0.5, tw, name)
+    raise KeyError(family)
+
+
+def get_modelled(family: str, rng) -> np.ndarray:
+    if family in ["binomial", "beta"]:
+        return rng.uniform(0.05, 0.95, len(MODEL_TIMES))
+    else:
+        return rng.uniform(5.0, 40.0, len(MODEL_TIMES))
+
+
+@pytest.mark.parametrize("family", FAMILIES)
+@pytest.mark.parametrize("time_weighted", [False, True])
+@pytest.mark.parametrize("prior_param", [False, True])
+def test_stacked_matches_reference(family: str, time_weighted: bool, prior_param: bool):
+    rng = np.random.default_rng(0)
+    disp_prior = esp.UniformPrior("disp", (1.0, 10.0))
+    parameters = {"disp": 3.0}
+
+    # A mix of targets on different outputs and times; with prior_param, the first
+    # target's distribution parameter is a prior and the others are fixed
+    idxs = [MODEL_TIMES[::3], MODEL_TIMES[5:40:2], MODEL_TIMES[10:20]]
+    params = [disp_prior if prior_param else 2.0, 4.0, 6.0]
+    targets = [
+        make_target(family, f"out_{i}", idx, rng, time_weighted, param)
+        for i, (idx, param) in enumerate(zip(idxs, params))
+    ]
+    modelled_do = {t.model_key: get_modelled(family, rng) for t in targets}
+
+    evaluators = {t.name: t.get_evaluator(MODEL_TIMES, None) for t in targets}
+    stacked, unstacked = est.group_evaluators(evaluators)
+    assert len(stacked) == 1 and not unstacked
+
+    expected = [
+        reference_evaluate(evaluators[n], modelled_do[evaluators[n].target.model_key], parameters)
+        for n in stacked[0].names
+    ]
+    fused = jax.jit(stacked[0].evaluate_components)(modelled_do, parameters)
+    np.testing.assert_allclose(fused, expected, rtol=1e-5, atol=1e-5)
+
+    for n in stacked[0].names:
+        ev = evaluators[n]
+        ll = ev.evaluate(modelled_do[ev.target.model_key], parameters)
+        expected_ll = reference_evaluate(ev, modelled_do[n], parameters)
+        np.testing.assert_allclose(ll, expected_ll, rtol=1e-5, atol=1e-5)
+
+
+def test_empty_target_raises():
+    data = pd.Series([1.0, 2.0], index=[100.0, 101.0])
+    target = est.NormalTarget("outside", data, 1.0)
+    with pytest.raises(ValueError, match="outside"):
+        target.get_evaluator(MODEL_TIMES, None)
+
+
+def grid(*values):
+    """Return flattened arrays covering every combination of values"""
+    return [g.ravel() for g in np.meshgrid(*[np.asarray(v, dtype=float) for v in values])]
+
+
+def series(values) -> pd.Series:
+    return pd.Series(values, index=MODEL_TIMES[: len(values)])
+
+
+@pytest.mark.parametrize("n", [0.5, 5.0, 1000.0])
+def test_negbin_kernel(n: float):
+    # Includes k=0, and modelled means near zero (where p is clamped) and very large
+    k, mu = grid([0.0, 1.0, 7.0, 250.0], [1e-20, 1e-3, 3.0, 1e6])
+    ev = est.NegativeBinomialTarget("nb", series(k), n).get_evaluator(MODEL_TIMES, None)
+
+    ll = ev.ll_kernel(ev.kernel_data, mu, n)
+
+    # Computed from p directly; nbinom.logpmf takes 1 - p, which cannot represent the
+    # clamped p of 1e-16 (recovering 1.11e-16 instead)
+    p = np.maximum(mu / (mu + n), 1e-16)
+    lcoeff = jsp.special.gammaln(k + n) - jsp.special.gammaln(n) - jsp.special.gammaln(k + 1)
+    expected = lcoeff + n * np.log1p(-p) + jsp.special.xlogy(k, p)
+    np.testing.assert_allclose(ll, expected, rtol=1e-6, atol=1e-6)
+
+    # Where p is not clamped, the library density agrees
+    unclamped = mu / (mu + n) > 1e-8
+    expected_lib = jsp.stats.nbinom.logpmf(k, n, 1.0 - p)
+    np.testing.assert_allclose(ll[unclamped], expected_lib[unclamped], rtol=1e-4, atol=1e-4)
+
+
+def test_binomial_kernel():
+    # Proportions giving k=0, k=n and non-integer k (=data*n), with p near 0 and 1
+    data, p = grid([0.0, 1.0 / 3.0, 0.5, 1.0], [1e-6, 0.3, 0.5, 1.0 - 1e-6])
+    sample_sizes = np.tile([10.0, 25.0], len(data) // 2)
+    target = est.BinomialTarget("binom", series(data), series(sample_sizes))
+    ev = target.get_evaluator(MODEL_TIMES, None)
+
+    ll = ev.ll_kernel(ev.kernel_data, p, None)
+    expected = tfpd.Binomial(total_count=sample_sizes, probs=p).log_prob(data * sample_sizes)
+    np.testing.assert_allclose(ll, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_binomial_kernel_degenerate():
+    # p of exactly 0 or 1 is only finite where the data agrees
+    data = np.array([0.0, 1.0, 0.5, 0.5])
+    p = np.array([0.0, 1.0, 0.0, 1.0])
+    target = est.BinomialTarget("binom", series(data), series(np.full(4, 10.0)))
+    ev = target.get_evaluator(MODEL_TIMES, None)
+
+    ll = ev.ll_kernel(ev.kernel_data, p, None)
+    np.testing.assert_allclose(ll, [0.0, 0.0, -np.inf, -np.inf])
+
+
+def test_beta_kernel():
+    # Modelled proportions near 0 and 1, with a or b of 1 and below 1
+    m, a, b = grid([1e-6, 0.2, 0.7, 1.0 - 1e-6], [0.5, 1.0, 4.0], [0.5, 1.0, 3.0])
+    target = est.BetaTarget("beta", series(np.full(len(m), 0.5)), series(a), series(b))
+    ev = target.get_evaluator(MODEL_TIMES, None)
+
+    ll = ev.ll_kernel(ev.kernel_data, m, None)
+    expected = tfpd.Beta(a, b).log_prob(m)
+    np.testing.assert_allclose(ll, expected, rtol=1e-4, atol=1e-4)